@@ -0,0 +1,159 @@
+"""
+Append-only aggregate store: running sums and counts per (video_id, subject_id) and per (video_id, time_bin), so
+new batches of cleaned frames are merged without recomputing the history. The aggregates of each batch are appended
+to a log which is merged into the tables when they are read or when the log outgrows them, so an update costs
+O(batch) amortized.
+"""
+
+
+import numpy as np
+import pandas as pd
+
+from _code.functions import pack_emotions
+from _code.emotions import compute_features, README_METRICS
+
+
+class AggregateStore:
+
+    """
+    Running per-subject and per-time-bin aggregates of cleaned frames.
+    Time bins have a fixed length of bin_ms milliseconds and are numbered from 1.
+    """
+
+    def __init__(self, bin_ms=1000, metrics=None):
+        self.bin_ms = bin_ms
+        self.metrics = list(README_METRICS if metrics is None else metrics)
+        sums = [m + '_sum' for m in self.metrics]
+        self._tables = {
+            'subjects': pd.DataFrame(columns=['frames', 'first_ms', 'last_ms'] + sums, dtype='float64',
+                                     index=pd.MultiIndex.from_arrays([[], []], names=['video_id', 'subject_id'])),
+            'bins': pd.DataFrame(columns=['frames'] + sums, dtype='float64',
+                                 index=pd.MultiIndex.from_arrays([[], []], names=['video_id', 'time_bin']))}
+        self._logs = {'subjects': [], 'bins': []}
+        self._pending = {'subjects': 0, 'bins': 0}
+
+    @property
+    def subjects(self):
+        self._compact('subjects')
+        return self._tables['subjects']
+
+    @subjects.setter
+    def subjects(self, df):
+        self._tables['subjects'], self._logs['subjects'], self._pending['subjects'] = df, [], 0
+
+    @property
+    def bins(self):
+        self._compact('bins')
+        return self._tables['bins']
+
+    @bins.setter
+    def bins(self, df):
+        self._tables['bins'], self._logs['bins'], self._pending['bins'] = df, [], 0
+
+    def _append(self, name, new):
+        # appends batch aggregates to the log; merging when the log outgrows the table keeps the cost amortized O(new)
+        self._logs[name].append(new.astype('float64'))
+        self._pending[name] += len(new)
+        if self._pending[name] > len(self._tables[name]):
+            self._compact(name)
+
+    def _compact(self, name):
+        # merges the log into the table: sums are added, time ranges are extended
+        log, table = self._logs[name], self._tables[name]
+        if not log:
+            return
+        df = pd.concat(([table] if len(table) else []) + log)
+        how = dict([(c, 'sum') for c in table.columns] + [('first_ms', 'min'), ('last_ms', 'max')])
+        self._tables[name] = df.groupby(level=table.index.names).agg({c: how[c] for c in table.columns})
+        self._logs[name], self._pending[name] = [], 0
+
+    def update(self, df):
+
+        """
+        Merges a batch of cleaned frames into the store
+
+        @param df: a cleaned dataframe (integer id, time and emotion columns)
+        """
+
+        x = compute_features(pack_emotions(df), self.metrics).add_suffix('_sum')
+        x['frames'] = 1
+        x['video_id'] = df['video_id'].to_numpy()
+        x['subject_id'] = df['subject_id'].to_numpy()
+        x['time_bin'] = df['millisecond_from_start'].to_numpy() // self.bin_ms + 1
+        x['first_ms'] = x['last_ms'] = df['millisecond_from_start'].to_numpy()
+        sums = ['frames'] + [m + '_sum' for m in self.metrics]
+
+        subjects = x.groupby(['video_id', 'subject_id']).agg(dict([(c, 'sum') for c in sums] +
+                                                                  [('first_ms', 'min'), ('last_ms', 'max')]))
+        self._append('subjects', subjects[self._tables['subjects'].columns])
+        self._append('bins', x.groupby(['video_id', 'time_bin'])[sums].sum())
+
+    def subject_means(self):
+
+        """
+        @return: per subject number of frames, mean time between frames and average metrics
+        """
+
+        df = pd.DataFrame({'no_of_frames': self.subjects['frames'].astype('int64'),
+                           'time_diff': (self.subjects['last_ms'] - self.subjects['first_ms']) /
+                                        (self.subjects['frames'] - 1).replace(0, np.nan)})
+        for m in self.metrics:
+            df[m + '_avg'] = self.subjects[m + '_sum'] / self.subjects['frames']
+
+        return df
+
+    def bin_means(self):
+
+        """
+        @return: per video and time bin average metrics
+        """
+
+        return pd.DataFrame({m + '_avg': self.bins[m + '_sum'] / self.bins['frames'] for m in self.metrics})
+
+    def video_means(self):
+
+        """
+        @return: per video metrics, averaged over time bins (metric_i_total)
+        """
+
+        df = self.bin_means().groupby('video_id').mean()
+        df.columns = [m + '_total' for m in self.metrics]
+
+        return df
+
+    def save(self, path):
+
+        """
+        Saves the store to a compressed .npz file
+
+        @param path: file path
+        """
+
+        arrays = {'bin_ms': np.array(self.bin_ms), 'metrics': np.array(self.metrics)}
+        for name, df in [('subjects', self.subjects), ('bins', self.bins)]:
+            for level in df.index.names:
+                arrays['{}.{}'.format(name, level)] = df.index.get_level_values(level).to_numpy(dtype='int64')
+            for c in df.columns:
+                arrays['{}.{}'.format(name, c)] = df[c].to_numpy()
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+
+        """
+        Loads a store saved by save
+
+        @param path: file path
+        @return: AggregateStore
+        """
+
+        with np.load(path) as arrays:
+            store = cls(bin_ms=int(arrays['bin_ms']), metrics=list(arrays['metrics']))
+            for name in ['subjects', 'bins']:
+                df = getattr(store, name)
+                index = pd.MultiIndex.from_arrays([arrays['{}.{}'.format(name, level)] for level in df.index.names],
+                                                  names=df.index.names)
+                setattr(store, name, pd.DataFrame({c: arrays['{}.{}'.format(name, c)] for c in df.columns},
+                                                  index=index))
+
+        return store
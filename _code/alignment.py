@@ -0,0 +1,114 @@
+"""
+Time alignment: resamples the signal of each subject onto a fixed time grid per video, so that subjects recorded with
+different framerates can be compared and averaged step by step.
+"""
+
+
+import warnings
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from _code.functions import EMOTIONS
+
+
+# subjects: subject ids (first axis of values), grid: start of each time step in ms (second axis),
+# columns: column names (third axis), values: float32 array of shape (subjects, time steps, columns)
+Aligned = namedtuple('Aligned', ['subjects', 'grid', 'columns', 'values'])
+
+
+def align_video(df, step_ms=1000, mode='hold', columns=None):
+
+    """
+    Resamples frames of a single video onto a time grid with a given step
+
+    @param df: cleaned frames of one video
+    @param step_ms: grid step in ms
+    @param mode: 'hold' - value of the last frame at the start of each step (sample-and-hold),
+                 'mean' - time-weighted average over each step; a frame lasts until the next frame of the subject
+    @param columns: columns to resample; None - emotions
+    @return: Aligned; steps outside of the subject's first and last frame are nan
+    """
+
+    if columns is None:
+        columns = EMOTIONS
+
+    subject = df['subject_id'].to_numpy()
+    ms = df['millisecond_from_start'].to_numpy().astype(np.int64)
+    order = np.lexsort((ms, subject))
+    codes, subjects = pd.factorize(subject[order], sort=True)
+    ms = ms[order]
+    x = df[columns].to_numpy(dtype=np.float64)[order]
+
+    grid = np.arange(0, ms.max() + step_ms, step_ms) if len(ms) else np.zeros(0, dtype=np.int64)
+
+    # rows of subject i are starts[i]:stops[i]; key is increasing along the sorted frames
+    starts = np.searchsorted(codes, np.arange(len(subjects)))
+    stops = np.searchsorted(codes, np.arange(len(subjects)), side='right')
+    first, last = ms[starts], ms[stops - 1]
+    span = int(grid[-1]) + 2 * step_ms + 1 if len(grid) else 1
+    key = codes.astype(np.int64) * span + ms
+
+    def frame_at(t):
+        # index of the last frame at or before t (t has a shape (subjects, steps))
+        return np.searchsorted(key, np.arange(len(subjects))[:, None] * span + t, side='right') - 1
+
+    if mode == 'hold':
+        t = np.broadcast_to(grid, (len(subjects), len(grid)))
+        values = x[np.maximum(frame_at(t), 0)]
+        outside = (t < first[:, None]) | (t > last[:, None])
+        values[outside] = np.nan
+
+    elif mode == 'mean':
+        # integral of the step signal from the first frame of the subject: cum[j] at frame j
+        duration = np.diff(ms, append=ms[-1:])
+        duration[stops - 1] = 0
+        cum = np.vstack([np.zeros((1, len(columns))), np.cumsum(x * duration[:, None], axis=0)])
+
+        def integral(t):
+            i = frame_at(t)
+            return cum[i] - cum[starts][:, None] + x[i] * (t - ms[i])[..., None]
+
+        a = np.clip(grid[None, :], first[:, None], last[:, None])
+        b = np.clip(grid[None, :] + step_ms, first[:, None], last[:, None])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            values = (integral(b) - integral(a)) / (b - a)[..., None]
+        values[b <= a] = np.nan
+
+    else:
+        raise ValueError("mode should be 'hold' or 'mean'")
+
+    return Aligned(np.asarray(subjects), grid, list(columns), values.astype(np.float32))
+
+
+def align(df, step_ms=1000, mode='hold', columns=None):
+
+    """
+    Resamples frames of each video onto a time grid with a given step
+
+    @param df: cleaned frames
+    @param step_ms: grid step in ms
+    @param mode: 'hold' or 'mean', see align_video
+    @param columns: columns to resample; None - emotions
+    @return: a dict {video_id: Aligned}
+    """
+
+    return {v: align_video(x, step_ms, mode, columns) for v, x in df.groupby('video_id')}
+
+
+def video_average(aligned):
+
+    """
+    Averages aligned values over subjects
+
+    @param aligned: Aligned
+    @return: a dataframe indexed by time step, one column per resampled column
+    """
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        values = np.nanmean(aligned.values, axis=0) if len(aligned.subjects) else \
+            np.full((len(aligned.grid), len(aligned.columns)), np.nan)
+
+    return pd.DataFrame(values, index=pd.Index(aligned.grid, name='Time, ms'), columns=aligned.columns)
@@ -4,52 +4,42 @@
 
 
 from _code.functions import *
+from _code.subjects import SubjectIndex
+from _code.emotions import aggregate
 
 
-# Load data
-df_all, df1, df2, df3 = load_data(data_path)
-columns = list(df1.columns)
+# Load data, collecting the report on non-numeric values while parsing
+profile = NoValueProfile()
+df_all, index = load_videos(data_path, profile=profile)
+df1, df2, df3 = video_frames(df_all, index)
+columns = COLUMNS
 
 
 # each file corresponds to only one video
-print(set(df1.video_id), set(df2.video_id), set(df3.video_id))
+print(set(df1.video_id) - {NO_VALUE_INT}, set(df2.video_id) - {NO_VALUE_INT}, set(df3.video_id) - {NO_VALUE_INT})
 print('')
 
 # each subject watched only one video => can group by subject_id
-print(set(df1.subject_id) & set(df2.subject_id))
-print(set(df2.subject_id) & set(df3.subject_id))
+print(set(df1.subject_id) & set(df2.subject_id) - {NO_VALUE_INT})
+print(set(df2.subject_id) & set(df3.subject_id) - {NO_VALUE_INT})
 print('')
 
-# no Nan values, missing values are labeled as 'No value'.
-df_all.isnull().values.any()
-
 """
 The only non-numeric values is "No value".
 Values from sets {video_id, subject_id} and {emotions} are equal to 'No value' together. For example,
 if video_id = 'No value', then subject_id = 'No value' as well.
 
-print('video 1')
-no_value(df1)
-print('')
-
-print('video 2')
-no_value(df2)
-print('')
-
-print('video 3')
-no_value(df3)
-print('')
-
-print('video all')
-no_value(df_all)
-print('')
+profile.show()
 
 """
 
-# Replace missing id values
-df_all['no_value_id'] = df_all['subject_id'].apply(lambda x: 1 if str(x) == 'No value' else 0)
-df_all['no_value_emotion'] = df_all['positive_1'].apply(lambda x: 1 if str(x) == 'No value' else 0)
-df_all.update(replace_no_value_id(df_all))
+# Replace missing id values: 'no_value_id' and 'no_value_emotion' masks are set by the loader
+df_all = replace_no_value_id_typed(df_all)
+# drop frames whose ids could not be replaced: they keep NO_VALUE_INT ids
+unresolved = df_all['no_value_id'].to_numpy() != 0
+if unresolved.any():
+    print('{} frames with missing ids which could not be replaced were dropped'.format(unresolved.sum()))
+df_all = df_all[~unresolved]
 
 
 # Plot statistics on missing emotion values
@@ -60,14 +50,7 @@ plot_no_value_emotion(df_all)
 # remove subjects with the proportion of missing emotion data > a given threshold
 df_all = remove_subjects_no_value_emotion(df_all, threshold=30)
 # remove missing values
-df_all = df_all.drop(df_all[df_all['no_value_emotion'] == 1].index)
-df_all = df_all[columns]
-
-
-# Convert to integer
-for c in columns:
-    df_all[c] = pd.to_numeric(df_all[c])
-    df_all[c] = df_all[c].astype('int32')
+df_all = df_all.loc[df_all['no_value_emotion'] == 0, columns]
 
 
 # Sort and remove duplicates
@@ -76,9 +59,10 @@ df_all = remove_duplicates(df_all)
 print('')
 
 
-# Create new features
-df_all['no_of_frames'] = df_all.groupby(['subject_id'])['subject_id'].transform('size')
-df_all['time_diff'] = df_all.groupby(['subject_id'])['millisecond_from_start'].transform('diff')
+# Create new features: frames are sorted by subject => per-subject segments are indexed once
+subjects = SubjectIndex(df_all)
+df_all['no_of_frames'] = subjects.repeat(subjects.sizes)
+df_all['time_diff'] = subjects.diff(df_all['millisecond_from_start'])
 
 
 # Investigate the data
@@ -87,16 +71,16 @@ size = df_all.shape[0]
 # Video length
 print('Videos are at least 30, 53 and 46 seconds long')
 print('max')
-print(df_all.groupby('video_id')['millisecond_from_start'].max())
+print(subjects.video_reduce(np.maximum, subjects.max(df_all['millisecond_from_start'])))
 print('min')
-print(df_all.groupby('video_id')['millisecond_from_start'].min())
+print(subjects.video_reduce(np.minimum, subjects.min(df_all['millisecond_from_start'])))
 print('')
 
 # Sample sizes
 print('Sample size:')
 print('Samples are more or less statistically significant (population = 1M, Margin of error=5%, conf.level 90% = 271'
       ' / 95% = 384')
-print(df_all.groupby('video_id')['subject_id'].nunique(), '\n')
+print(subjects.video_subjects(), '\n')
 
 # Plot Number of frames distribution
 plot_num_of_frames(df_all, bins=(100, 50))
@@ -136,20 +120,10 @@ bins_no = 53
 df_all['time_bin'] = pd.cut(df_all['millisecond_from_start'], bins=bins_no, labels=list(range(1, bins_no+1)))
 
 
-# Compute metrics
+# Compute average emotion for each time bin: metrics are declared in emotions.py and aggregated in one pass
 metrics = ['metric_{}'.format(i) for i in [1, 2, 3]]
-df_all['metric_1'] = df_all['positive_count'] - df_all['negative_count']
-df_all['metric_2'] = df_all[emotions[:2]].any(axis=1).astype(int) - \
-                     (df_all[emotions[-3:]].any(axis=1)).astype(int)
-df_all['metric_3'] = df_all[emotions].any(axis=1).astype(int)
-
-
-# Compute average emotion for each time bin
 metrics_avg = ['metric_{}_avg'.format(i) for i in [1, 2, 3]]
-for i in [1, 2, 3]:
-    df_all['metric_{}_avg'.format(i)] = df_all.groupby(['video_id', 'time_bin'])['metric_{}'.format(i)].transform('mean')
-
-df_emotion = df_all[['video_id', 'time_bin']+metrics_avg].drop_duplicates()
+df_emotion = aggregate(df_all, ['video_id', 'time_bin'], metrics).reset_index()
 
 
 # plot emotion evolution
@@ -0,0 +1,190 @@
+"""
+Benchmark of the cleaning and metric pipeline on synthetic data: wall time and peak traced memory of each stage for
+several data sizes. Results are saved as JSON to compare versions.
+
+With the default synthetic data some runs of missing ids cross subject boundaries. Neither replace_no_value_id (the
+legacy chain) nor replace_no_value_id_typed can attribute them to a subject, so the 'unresolved' count of these stages
+is not 0 and the legacy chain keeps 'No value' ids. Pass --no-boundary-gaps for data which both chains repair
+completely.
+
+Usage (from the repository root):
+    python -m _code.benchmark --rows 100000 1000000 --output bench.json
+    python -m _code.benchmark --rows 100000 --legacy --no-boundary-gaps
+"""
+
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import platform
+import tracemalloc
+import contextlib
+import subprocess
+
+import numpy as np
+import pandas as pd
+
+from _code.functions import load_data, load_videos, replace_no_value_id, replace_no_value_id_typed, \
+    remove_subjects_no_value_emotion, remove_duplicates, pack_emotions
+from _code.emotions import compute_features, README_METRICS
+from _code.synthetic import write_videos
+
+
+def measure(func, *args):
+
+    """
+    Runs a function twice: once for its wall time and once for its peak memory traced by tracemalloc, which slows down
+    allocations. The function must give the same result when called again on its arguments.
+
+    @param func: function
+    @param args: function arguments
+    @return: function result + a dict with 'seconds' and 'peak_mb'
+    """
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        t = time.perf_counter()
+        func(*args)
+        seconds = time.perf_counter() - t
+
+        tracemalloc.start()
+        try:
+            result = func(*args)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    return result, {'seconds': seconds, 'peak_mb': peak / 2 ** 20}
+
+
+def legacy_stages(path):
+
+    """
+    Stages of analysis_draft.py on string columns. The stages update the dataframe in place, as the script does; both
+    are idempotent, so they can be measured twice (see measure).
+
+    @param path: data path function
+    @return: generator of (stage name, result, measurements)
+    """
+
+    df, m = measure(lambda: load_data(path)[0])
+    yield 'load_data', df, m
+
+    def label(df):
+        df['no_value_id'] = df['subject_id'].apply(lambda x: 1 if str(x) == 'No value' else 0)
+        df['no_value_emotion'] = df['positive_1'].apply(lambda x: 1 if str(x) == 'No value' else 0)
+        return df
+
+    df, m = measure(label, df)
+    yield 'label_no_value', df, m
+
+    def replace(df):
+        df.update(replace_no_value_id(df))
+        return df
+
+    df, m = measure(replace, df)
+    m['unresolved'] = int((df['subject_id'].astype(str) == 'No value').sum())
+    yield 'replace_no_value_id', df, m
+
+
+def typed_stages(path, bins_no=53):
+
+    """
+    Stages of the cleaning and metric pipeline on typed columns
+
+    @param path: data path function
+    @param bins_no: number of time bins
+    @return: generator of (stage name, result, measurements)
+    """
+
+    (df, _), m = measure(load_videos, path)
+    yield 'load_videos', df, m
+
+    df, m = measure(replace_no_value_id_typed, df)
+    m['unresolved'] = int((df['no_value_id'] != 0).sum())
+    yield 'replace_no_value_id_typed', df, m
+
+    df, m = measure(remove_subjects_no_value_emotion, df)
+    yield 'remove_subjects_no_value_emotion', df, m
+
+    df = df[df['no_value_emotion'] == 0]
+    df, m = measure(lambda x: x.sort_values(['video_id', 'subject_id', 'frame_no', 'millisecond_from_start'],
+                                            ignore_index=True), df)
+    yield 'sort', df, m
+
+    df, m = measure(remove_duplicates, df)
+    yield 'remove_duplicates', df, m
+
+    features, m = measure(lambda x: compute_features(pack_emotions(x), README_METRICS), df)
+    yield 'metrics', features, m
+
+    def time_bins(df, features):
+        x = features.copy()
+        x['video_id'] = df['video_id'].to_numpy()
+        x['time_bin'] = pd.cut(df['millisecond_from_start'], bins=bins_no,
+                               labels=list(range(1, bins_no + 1))).to_numpy()
+        return x.groupby(['video_id', 'time_bin'], observed=True).mean()
+
+    x, m = measure(time_bins, df, features)
+    yield 'time_bins', x, m
+
+
+def run(rows, legacy=False, directory=None, seed=0, **synthetic):
+
+    """
+    Runs the benchmark
+
+    @param rows: list of data sizes
+    @param legacy: if True, also benchmark the string-based stages of analysis_draft.py
+    @param directory: directory for synthetic data; None - a temporary directory
+    @param seed: random seed of the synthetic data
+    @param synthetic: parameters of the synthetic data (see synthetic.generate_subjects), e.g. boundary_gaps=False
+                      for data without runs of missing ids across subjects, which the cleaning chains cannot repair
+    @return: list of result records
+    """
+
+    results = []
+    for n in rows:
+        with tempfile.TemporaryDirectory(dir=directory) as tmp:
+            path = write_videos(tmp, rows=n, seed=seed, **synthetic)
+            stages = [typed_stages(path)] + ([legacy_stages(path)] if legacy else [])
+            for stage, result, m in (s for g in stages for s in g):
+                results.append(dict(rows=n, stage=stage, rows_out=len(result), **m))
+                print('{:>12} {:<35} {:>9.3f} s {:>10.1f} MB'.format(n, stage, m['seconds'], m['peak_mb']))
+
+    return results
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[10 ** 5, 10 ** 6])
+    parser.add_argument('--legacy', action='store_true', help='also benchmark the stages of analysis_draft.py')
+    parser.add_argument('--directory', default=None, help='directory for synthetic data')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-boundary-gaps', action='store_true',
+                        help='no runs of missing ids across subjects, which the cleaning chains cannot repair')
+    parser.add_argument('--duplicate-rate', type=float, default=None,
+                        help='proportion of duplicated frames; default - see synthetic.generate_subjects')
+    parser.add_argument('--output', default='bench.json')
+    args = parser.parse_args(argv)
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+
+    synthetic = {'boundary_gaps': not args.no_boundary_gaps}
+    if args.duplicate_rate is not None:
+        synthetic['duplicate_rate'] = args.duplicate_rate
+    report = {'commit': commit, 'python': platform.python_version(), 'numpy': np.__version__,
+              'pandas': pd.__version__, 'synthetic': synthetic,
+              'results': run(args.rows, args.legacy, args.directory, args.seed, **synthetic)}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
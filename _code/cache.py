@@ -0,0 +1,164 @@
+"""
+On-disk cache of cleaned video frames. Each video file is cached in its own directory as one .npy file per column,
+keyed by a hash of the file contents and of the pipeline parameters. Emotions are stored as one packed uint8 column
+(see functions.pack_frame); functions.unpack_frame restores the emotion columns on demand. The videos are also
+concatenated into one .npy file per column, so the merged dataframe is memory-mapped rather than copied into memory.
+"""
+
+
+import os
+import glob
+import json
+import shutil
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from _code.functions import data_files, pack_frame, DUPLICATE_COLUMNS
+from _code.pipeline import clean_video
+from _code.profiling import profiler
+
+
+# bump when the cleaning logic changes to invalidate existing entries
+CACHE_VERSION = 2
+
+
+def file_hash(file, block_size=2 ** 20):
+
+    """
+    @param file: path to a file
+    @param block_size: number of bytes read at once
+    @return: sha256 of file contents
+    """
+
+    h = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+
+    return h.hexdigest()
+
+
+def cache_key(file, threshold):
+
+    """
+    @param file: path to a video file
+    @param threshold: threshold passed to remove_subjects_no_value_emotion
+    @return: hash of file contents and pipeline parameters
+    """
+
+    params = {'version': CACHE_VERSION, 'threshold': threshold, 'duplicate_columns': DUPLICATE_COLUMNS}
+    h = hashlib.sha256(file_hash(file).encode())
+    h.update(json.dumps(params, sort_keys=True).encode())
+
+    return h.hexdigest()[:16]
+
+
+def save_frame(df, directory):
+
+    """
+    Saves a dataframe as one .npy file per column
+
+    @param df: dataframe with numeric columns
+    @param directory: target directory
+    """
+
+    tmp = directory + '.tmp'
+    os.makedirs(tmp, exist_ok=True)
+    for i, c in enumerate(df.columns):
+        np.save(os.path.join(tmp, '{}.npy'.format(i)), df[c].to_numpy())
+    with open(os.path.join(tmp, 'columns.json'), 'w') as f:
+        json.dump(list(df.columns), f)
+    os.replace(tmp, directory)
+
+
+def load_frame(directory):
+
+    """
+    Loads a dataframe saved by save_frame; columns are memory-mapped, not read
+
+    @param directory: directory written by save_frame
+    @return: a dataframe
+    """
+
+    with open(os.path.join(directory, 'columns.json')) as f:
+        columns = json.load(f)
+
+    return pd.DataFrame({c: np.load(os.path.join(directory, '{}.npy'.format(i)), mmap_mode='r')
+                         for i, c in enumerate(columns)}, copy=False)
+
+
+def merge_frames(directories, directory):
+
+    """
+    Concatenates dataframes saved by save_frame into one saved dataframe. Rows are copied from file to file one column
+    at a time through memory maps.
+
+    @param directories: directories written by save_frame, in the order of the rows; all with the same columns
+    @param directory: target directory
+    """
+
+    frames = [load_frame(d) for d in directories]
+    rows = sum(len(df) for df in frames)
+
+    tmp = directory + '.tmp'
+    os.makedirs(tmp, exist_ok=True)
+    for i, c in enumerate(frames[0].columns):
+        x = np.lib.format.open_memmap(os.path.join(tmp, '{}.npy'.format(i)), mode='w+', dtype=frames[0][c].dtype,
+                                      shape=(rows,))
+        start = 0
+        for df in frames:
+            x[start:start + len(df)] = df[c].to_numpy()
+            start += len(df)
+        x.flush()
+        del x
+    with open(os.path.join(tmp, 'columns.json'), 'w') as f:
+        json.dump(list(frames[0].columns), f)
+    os.replace(tmp, directory)
+
+
+@profiler.profile
+def cached_pipeline(path, cache_dir, threshold=30, max_workers=None):
+
+    """
+    Cleans all video files, reusing cached results of files whose contents and parameters did not change
+
+    @param path: data_path or data_path_jup
+    @param cache_dir: cache directory
+    @param threshold: threshold passed to remove_subjects_no_value_emotion
+    @param max_workers: number of worker processes for the files to be rebuilt; None - number of cores
+    @return: a merged cleaned packed dataframe; columns are memory-mapped (read-only)
+    """
+
+    entries, missing = {}, []
+    for i, file in data_files(path).items():
+        entries[i] = os.path.join(cache_dir, 'video_{}-{}'.format(i, cache_key(file, threshold)))
+        if not os.path.isdir(entries[i]):
+            missing.append((i, file))
+
+    profiler.message('{} of {} videos loaded from cache'.format(len(entries) - len(missing), len(entries)))
+
+    if missing:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(clean_video, [f for _, f in missing], [threshold] * len(missing))
+            for (i, _), (df, _) in zip(missing, results):
+                for old in glob.glob(os.path.join(cache_dir, 'video_{}-*'.format(i))):
+                    shutil.rmtree(old)
+                save_frame(pack_frame(df), entries[i])
+
+    if not entries:
+        return pd.DataFrame()
+
+    # videos in video_id order; the merged entry is keyed by the video entries, so it is rebuilt when any of them is
+    frames = {d: load_frame(d) for d in entries.values()}
+    directories = sorted(frames, key=lambda d: frames[d]['video_id'].iloc[0] if len(frames[d]) else 0)
+    merged = os.path.join(cache_dir, 'merged-{}'.format(
+        hashlib.sha256(json.dumps([os.path.basename(d) for d in directories]).encode()).hexdigest()[:16]))
+    if not os.path.isdir(merged):
+        for old in glob.glob(os.path.join(cache_dir, 'merged-*')):
+            shutil.rmtree(old)
+        merge_frames(directories, merged)
+
+    return load_frame(merged)
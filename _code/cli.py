@@ -0,0 +1,223 @@
+"""
+Command line entry point for batch runs. Each subcommand imports only what it needs; matplotlib is loaded by the
+plot subcommand only. Tables are written as CSV or JSON to stdout or to --output; progress reports of the cleaning
+steps go to stderr. With --profile the stages are recorded as JSON lines (see profiling.Profiler) and progress reports
+go to the same file.
+
+Usage (from the repository root):
+    python -m _code.cli clean _data --output cleaned.csv
+    python -m _code.cli features _data --by subject --format json
+    python -m _code.cli stats _data --ci --resamples 10000
+    python -m _code.cli plot _data --output-dir plots/
+"""
+
+
+import os
+import sys
+import json
+import argparse
+import contextlib
+
+from _code.emotions import README_METRICS
+from _code.profiling import profiler, json_sink
+
+
+def _path(directory):
+    # data path function (as functions.data_path) for a data directory
+    return lambda i: os.path.join(directory, 'dsc_homework_video_{}.csv'.format(i))
+
+
+@profiler.profile(name='clean_data')
+def _clean(args):
+    # typed cleaning chain on packed emotions; frames with ids which could not be replaced are dropped
+    from _code.functions import load_videos, remove_duplicates
+    from _code.streaming import clean_chunk
+
+    with contextlib.redirect_stdout(sys.stderr):
+        df, _ = load_videos(_path(args.data), chunksize=args.chunksize, packed=True)
+        raw = df
+        df, _, unresolved = clean_chunk(df, args.threshold)
+        df = remove_duplicates(df).reset_index(drop=True)
+        if unresolved:
+            profiler.message('{} frames with missing ids which could not be replaced were dropped'.format(unresolved))
+
+    return raw, df
+
+
+@profiler.profile(name='write')
+def _write(df, args, index=False):
+    # writes a table as CSV or JSON (records) to --output or stdout
+    output = args.output if args.output not in (None, '-') else sys.stdout
+    if args.format == 'json':
+        text = df.reset_index().to_json(orient='records') if index else df.to_json(orient='records')
+        if output is sys.stdout:
+            print(text)
+        else:
+            with open(output, 'w') as f:
+                f.write(text + '\n')
+    else:
+        df.to_csv(output, index=index)
+
+
+@profiler.profile
+def clean(args):
+
+    """
+    Writes cleaned frames
+    """
+
+    from _code.functions import COLUMNS, unpack_frame
+
+    _, df = _clean(args)
+    _write(unpack_frame(df)[COLUMNS], args)
+
+
+@profiler.profile
+def features(args):
+
+    """
+    Writes average metrics per subject, time bin or video
+    """
+
+    from _code.emotions import aggregate
+
+    _, df = _clean(args)
+    metrics = args.metrics.split(',')
+    if args.by == 'subject':
+        import numpy as np
+        from _code.subjects import SubjectIndex
+        x = aggregate(df, ['video_id', 'subject_id'], metrics)
+        # frames are sorted by subject => the subjects of the index are in the order of the groups
+        subjects = SubjectIndex(df)
+        ms = df['millisecond_from_start'].to_numpy()
+        x['time_diff'] = (subjects.last(ms) - subjects.first(ms)) / np.where(subjects.sizes > 1, subjects.sizes - 1,
+                                                                             np.nan)
+    elif args.by == 'time_bin':
+        df['time_bin'] = df['millisecond_from_start'] // args.bin_ms + 1
+        x = aggregate(df, ['video_id', 'time_bin'], metrics)
+    else:
+        x = aggregate(df, ['video_id'], metrics)
+
+    _write(x, args, index=True)
+
+
+@profiler.profile
+def stats(args):
+
+    """
+    Writes metric_i_total per video (average over time bins) and, with --ci, bootstrap confidence intervals of the
+    average subject metric
+    """
+
+    from _code.emotions import aggregate
+
+    _, df = _clean(args)
+    metrics = args.metrics.split(',')
+    df['time_bin'] = df['millisecond_from_start'] // args.bin_ms + 1
+    x = aggregate(df, ['video_id', 'time_bin'], metrics).drop(columns='frames').groupby('video_id').mean()
+    x.columns = [m + '_total' for m in metrics]
+
+    if args.ci:
+        from _code.inference import subject_table, bootstrap
+        subjects = subject_table(df, metrics)
+        for m in metrics:
+            ci = bootstrap(subjects, m, n_resamples=args.resamples, alpha=args.alpha, seed=args.seed,
+                           max_workers=args.workers)
+            x[m + '_mean'] = ci['mean']
+            x[m + '_ci_low'] = ci['ci_low']
+            x[m + '_ci_high'] = ci['ci_high']
+        x['subjects'] = ci['subjects']
+
+    _write(x, args, index=True)
+
+
+@profiler.profile
+def plot(args):
+
+    """
+    Saves the plots of analysis_draft.py to --output-dir and writes the list of files
+    """
+
+    import matplotlib
+    matplotlib.use('Agg')
+    from _code.functions import replace_no_value_id_typed, plot_no_value_emotion, plot_num_of_frames, plot_time, \
+        plot_emotion_evolution
+    from _code.emotions import aggregate
+    from _code.subjects import SubjectIndex
+
+    raw, df = _clean(args)
+    os.makedirs(args.output_dir, exist_ok=True)
+    path = lambda name: os.path.join(args.output_dir, '{}.{}'.format(name, args.image_format))
+
+    subjects = SubjectIndex(df)
+    df['no_of_frames'] = subjects.repeat(subjects.sizes)
+    df['time_bin'] = df['millisecond_from_start'] // args.bin_ms + 1
+    metrics = args.metrics.split(',')
+    metrics_avg = [m + '_avg' for m in metrics]
+    df_emotion = aggregate(df, ['video_id', 'time_bin'], metrics).reset_index()
+
+    with contextlib.redirect_stdout(sys.stderr):
+        plot_no_value_emotion(replace_no_value_id_typed(raw), output=path('no_value_emotion'))
+    plot_num_of_frames(df, output=path('num_of_frames'))
+    plot_time(df, bins=args.time_bins, output=path('time'))
+    plot_emotion_evolution(df_emotion, metrics=metrics_avg, output=path('emotion_evolution'))
+    for compare in ['metrics', 'videos']:
+        plot_emotion_evolution(df_emotion, metrics=metrics_avg, compare=compare,
+                               output=path('emotion_evolution_' + compare))
+
+    print(json.dumps(sorted(os.path.join(args.output_dir, f) for f in os.listdir(args.output_dir))))
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('data', nargs='?', default='_data', help='directory with dsc_homework_video_X.csv files')
+    common.add_argument('--threshold', type=float, default=30, help='see remove_subjects_no_value_emotion')
+    common.add_argument('--chunksize', type=int, default=10 ** 6, help='number of rows parsed at once')
+    common.add_argument('--metrics', default=','.join(README_METRICS), help='registered features, comma separated')
+    common.add_argument('--bin-ms', type=int, default=1000, help='time bin length, ms')
+    common.add_argument('--profile', default=None, help='JSON lines file for stage records and progress reports')
+
+    def table(p, format='csv'):
+        p.add_argument('--format', choices=['csv', 'json'], default=format)
+        p.add_argument('--output', default=None, help='output file; default - stdout')
+
+    p = commands.add_parser('clean', parents=[common], help='cleaned frames')
+    table(p)
+    p.set_defaults(func=clean)
+
+    p = commands.add_parser('features', parents=[common], help='average metrics per group')
+    table(p)
+    p.add_argument('--by', choices=['subject', 'time_bin', 'video'], default='subject')
+    p.set_defaults(func=features)
+
+    p = commands.add_parser('stats', parents=[common], help='metric_i_total per video')
+    table(p, format='json')
+    p.add_argument('--ci', action='store_true', help='add bootstrap confidence intervals')
+    p.add_argument('--resamples', type=int, default=10000)
+    p.add_argument('--alpha', type=float, default=0.05)
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--workers', type=int, default=1, help='bootstrap worker processes')
+    p.set_defaults(func=stats)
+
+    p = commands.add_parser('plot', parents=[common], help='save plots')
+    p.add_argument('--output-dir', default='plots')
+    p.add_argument('--image-format', default='png')
+    p.add_argument('--time-bins', type=int, default=53, help='number of bins of the time distribution')
+    p.set_defaults(func=plot)
+
+    args = parser.parse_args(argv)
+    if args.profile:
+        profiler.enabled = True
+        profiler.sinks.append(json_sink(args.profile))
+    args.func(args)
+    if args.profile:
+        print(profiler.summary().round(3).to_string(), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,160 @@
+"""
+Bit-packed emotions: the five binary emotion columns are stored as one uint8 per frame (see pack_emotions) and
+per-frame features are computed through lookup tables indexed by the packed byte.
+
+Features are declared once, by a function of the packed byte (register_feature) or by a formula over emotions and
+other features (define_metric), e.g.
+    define_metric('metric_4', 'positive_1 - negative_1 - negative_2')
+Aggregation counts frames per group and packed value in one pass; sums of all features are then a product of the
+counts with the lookup tables, so each additional feature costs a column of 2 ** len(EMOTIONS) values.
+"""
+
+
+import numpy as np
+import pandas as pd
+
+from _code.functions import EMOTIONS, pack_emotions
+
+
+# all possible packed values
+CODES = np.arange(2 ** len(EMOTIONS), dtype=np.uint8)
+POSITIVE_MASK = np.uint8(0b00011)
+NEGATIVE_MASK = np.uint8(0b11100)
+
+# number of set bits for each packed value
+POPCOUNT = np.array([bin(c).count('1') for c in CODES], dtype=np.int8)
+
+# feature name -> lookup table of 2 ** len(EMOTIONS) values
+FEATURES = {}
+
+
+def register_feature(name, func):
+
+    """
+    Registers a per-frame feature defined on the packed byte
+
+    @param name: feature name
+    @param func: function of a uint8 array of packed values, returning an array of the same length
+    """
+
+    FEATURES[name] = np.asarray(func(CODES.copy()))
+
+
+register_feature('positive_count', lambda x: POPCOUNT[x & POSITIVE_MASK])
+register_feature('negative_count', lambda x: POPCOUNT[x & NEGATIVE_MASK])
+register_feature('emotions_count', lambda x: POPCOUNT[x])
+register_feature('any_positive', lambda x: ((x & POSITIVE_MASK) != 0).astype(np.int8))
+register_feature('any_negative', lambda x: ((x & NEGATIVE_MASK) != 0).astype(np.int8))
+register_feature('any_emotion', lambda x: (x != 0).astype(np.int8))
+
+
+def define_metric(name, formula):
+
+    """
+    Registers a per-frame feature defined by a formula, evaluated once on all packed values
+
+    @param name: feature name
+    @param formula: python expression over emotion names and registered features, e.g.
+                    'positive_count - negative_count' or '(positive_1 | positive_2) * (1 - negative_1)'
+    """
+
+    namespace = dict((c, ((CODES >> np.uint8(i)) & np.uint8(1)).astype(np.int8)) for i, c in enumerate(EMOTIONS))
+    namespace.update(FEATURES)
+    table = np.asarray(eval(compile(formula, '<metric {}>'.format(name), 'eval'), {'__builtins__': {}, 'np': np},
+                                    namespace))
+    if table.shape != CODES.shape:
+        table = np.broadcast_to(table, CODES.shape).copy()
+    if table.dtype == bool:
+        table = table.astype(np.int8)
+
+    FEATURES[name] = table
+
+
+# metrics proposed in the README
+define_metric('metric_1', 'positive_count - negative_count')
+define_metric('metric_2', 'any_positive - any_negative')
+define_metric('metric_3', 'any_emotion')
+README_METRICS = ['metric_1', 'metric_2', 'metric_3']
+
+
+def unpack_emotions(packed):
+
+    """
+    Restores the emotion columns from packed values
+
+    @param packed: uint8 array
+    @return: a dataframe with emotion columns
+    """
+
+    return pd.DataFrame({c: (packed >> np.uint8(i)) & np.uint8(1) for i, c in enumerate(EMOTIONS)})
+
+
+def compute_features(packed, names=None):
+
+    """
+    Computes per-frame features from packed emotions
+
+    @param packed: uint8 array
+    @param names: registered feature names; None - all registered features
+    @return: a dataframe with one column per feature
+    """
+
+    if names is None:
+        names = list(FEATURES)
+
+    return pd.DataFrame(feature_table(names)[packed], columns=names)
+
+
+def feature_table(names):
+
+    """
+    @param names: registered feature names
+    @return: array (2 ** len(EMOTIONS), features) of lookup tables
+    """
+
+    return np.column_stack([FEATURES[name] for name in names]) if names else np.zeros((len(CODES), 0))
+
+
+def aggregate(df, by, names=None, mean=True):
+
+    """
+    Aggregates features per group in one pass: frames are counted per group and packed value, feature sums are the
+    product of the counts and the lookup tables
+
+    @param df: frames with emotion columns (see pack_emotions)
+    @param by: grouping columns, e.g. ['video_id', 'subject_id'] or ['video_id', 'time_bin']
+    @param names: registered feature names; None - README metrics
+    @param mean: True - name_avg columns (average per frame), False - name columns (sums)
+    @return: a dataframe indexed by the grouping columns (observed groups only) with features and 'frames'
+    """
+
+    if names is None:
+        names = README_METRICS
+    by = list(by)
+
+    # mixed radix key over factorized grouping columns; rows with missing keys are dropped as by groupby
+    key = np.zeros(len(df), dtype=np.int64)
+    valid = np.ones(len(df), dtype=bool)
+    levels = []
+    for c in by:
+        codes, uniques = pd.factorize(df[c], sort=True)
+        key = key * len(uniques) + codes
+        valid &= codes >= 0
+        levels.append(uniques)
+    groups, key = np.unique(key[valid], return_inverse=True)
+
+    counts = np.bincount(key * len(CODES) + pack_emotions(df)[valid], minlength=len(groups) * len(CODES))
+    counts = counts.reshape(len(groups), len(CODES))
+    frames = counts.sum(axis=1)
+    sums = counts @ feature_table(names).astype(np.float64)
+
+    positions = np.unravel_index(groups, [len(u) for u in levels])
+    arrays = [np.asarray(u)[k] for u, k in zip(levels, positions)]
+    index = pd.MultiIndex.from_arrays(arrays, names=by) if len(by) > 1 else pd.Index(arrays[0], name=by[0])
+    if mean:
+        df = pd.DataFrame(sums / frames[:, None], columns=[name + '_avg' for name in names], index=index)
+    else:
+        df = pd.DataFrame(sums, columns=names, index=index)
+    df['frames'] = frames
+
+    return df
@@ -0,0 +1,87 @@
+"""
+Time-weighted aggregation of per-frame features: each frame is weighted by its duration instead of counting once,
+so subjects recorded with high framerates do not dominate and sparse subjects are not biased.
+"""
+
+
+import numpy as np
+
+from _code.functions import pack_emotions
+from _code.emotions import compute_features, README_METRICS
+
+
+def frame_duration(df, max_gap_ms=None):
+
+    """
+    Computes duration of each frame: time until the next frame of the same subject. The last frame of a subject lasts
+    as long as the previous one; subjects with a single frame get the median duration.
+
+    @param df: cleaned frames sorted by ['video_id', 'subject_id', 'frame_no', 'millisecond_from_start']
+    @param max_gap_ms: if not None, durations are capped by this value (a frame followed by a long gap)
+    @return: float64 array
+    """
+
+    ms = df['millisecond_from_start'].to_numpy().astype(np.float64)
+    subject = df['subject_id'].to_numpy()
+    video = df['video_id'].to_numpy()
+    if len(df) == 0:
+        return ms
+
+    # same[k] - frames k and k+1 belong to the same subject
+    same = (subject[1:] == subject[:-1]) & (video[1:] == video[:-1])
+    gap = np.diff(ms)
+    has_next = np.append(same, False)
+    is_last = ~has_next & np.insert(same, 0, False)
+
+    duration = np.full(len(ms), np.nan)
+    duration[has_next] = gap[same]
+    duration[is_last] = gap[np.flatnonzero(is_last) - 1]
+    if max_gap_ms is not None:
+        duration = np.minimum(duration, max_gap_ms)
+    duration[np.isnan(duration)] = np.nanmedian(duration) if (~np.isnan(duration)).any() else 1
+
+    return duration
+
+
+def weighted_metrics(df, by=('video_id', 'subject_id'), metrics=None, max_gap_ms=None):
+
+    """
+    Computes duration-weighted averages of per-frame features in one grouped pass
+
+    @param df: cleaned frames sorted by ['video_id', 'subject_id', 'frame_no', 'millisecond_from_start']
+    @param by: grouping columns, e.g. ('video_id', 'subject_id') or ('video_id', 'time_bin')
+    @param metrics: features registered in emotions.FEATURES (see emotions.register_feature); None - README metrics
+    @param max_gap_ms: see frame_duration
+    @return: a dataframe indexed by the grouping columns with metric_i_avg columns and total 'duration'
+    """
+
+    if metrics is None:
+        metrics = README_METRICS
+    by = list(by)
+
+    w = frame_duration(df, max_gap_ms)
+    x = compute_features(pack_emotions(df), metrics).astype(np.float64).mul(w, axis=0)
+    x['duration'] = w
+    for c in by:
+        x[c] = df[c].to_numpy()
+
+    x = x.groupby(by, observed=True).sum()
+    for m in metrics:
+        x[m + '_avg'] = x.pop(m) / x['duration']
+
+    return x[[m + '_avg' for m in metrics] + ['duration']]
+
+
+def video_metrics(subject_metrics):
+
+    """
+    Averages per-subject metrics over the viewers of each video
+
+    @param subject_metrics: output of weighted_metrics grouped by ('video_id', 'subject_id')
+    @return: a dataframe indexed by video_id with metric_i_total columns
+    """
+
+    x = subject_metrics.drop(columns='duration').groupby('video_id').mean()
+    x.columns = [c[:-len('_avg')] + '_total' for c in x.columns]
+
+    return x
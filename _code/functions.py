@@ -1,6 +1,27 @@
 import pandas as pd
+import numpy as np
 import os
-import matplotlib.pyplot as plt
+import re
+import glob
+
+try:
+    from _code.profiling import profiler
+except ImportError:
+    # imported as 'functions' from the notebook directory
+    from profiling import profiler
+
+
+# columns of dsc_homework_video_X.csv and their compact dtypes
+ID_COLUMNS = ['video_id', 'subject_id']
+EMOTIONS = ['positive_1', 'positive_2', 'negative_1', 'negative_2', 'negative_3']
+COLUMNS = ID_COLUMNS + ['frame_no', 'millisecond_from_start'] + EMOTIONS
+DTYPES = dict([(c, 'int32') for c in COLUMNS[:4]] + [(c, 'uint8') for c in EMOTIONS])
+# uint8 column replacing the emotion columns in packed frames (see pack_frame)
+EMOTION_CODE = 'emotions'
+
+# token used for missing values in the source files and the sentinel it is mapped to in int32 columns
+NO_VALUE = 'No value'
+NO_VALUE_INT = -1
 
 
 def data_path(i):
@@ -28,6 +49,117 @@ def data_path_jup(i):
     return '../_data/dsc_homework_video_{}.csv'.format(i)
 
 
+def pack_emotions(df):
+
+    """
+    Packs the emotion columns into one byte per frame: bit i corresponds to EMOTIONS[i]
+
+    @param df: input dataframe with 0/1 emotion columns, or a packed frame (see pack_frame)
+    @return: uint8 array; the stored column of a packed frame is returned as is
+    """
+
+    if EMOTION_CODE in df.columns:
+        return df[EMOTION_CODE].to_numpy()
+
+    packed = np.zeros(len(df), dtype=np.uint8)
+    for i, c in enumerate(EMOTIONS):
+        packed |= (df[c].to_numpy() != 0).astype(np.uint8) << np.uint8(i)
+
+    return packed
+
+
+def pack_frame(df):
+
+    """
+    Replaces the emotion columns by one packed uint8 column (EMOTION_CODE) at the place of the first of them. Other
+    columns are not copied.
+
+    @param df: input dataframe with 0/1 emotion columns
+    @return: a packed dataframe; a packed input is returned as is
+    """
+
+    if EMOTION_CODE in df.columns:
+        return df
+
+    columns = {}
+    for c in df.columns:
+        if c == EMOTIONS[0]:
+            columns[EMOTION_CODE] = pack_emotions(df)
+        elif c not in EMOTIONS:
+            columns[c] = df[c].to_numpy()
+
+    return pd.DataFrame(columns, index=df.index, copy=False)
+
+
+def unpack_frame(df):
+
+    """
+    Restores the emotion columns of a packed frame (see pack_frame)
+
+    @param df: a packed dataframe
+    @return: a dataframe with uint8 emotion columns in place of EMOTION_CODE; an unpacked input is returned as is
+    """
+
+    if EMOTION_CODE not in df.columns:
+        return df
+
+    columns = {}
+    for c in df.columns:
+        if c == EMOTION_CODE:
+            packed = df[c].to_numpy()
+            columns.update((e, (packed >> np.uint8(i)) & np.uint8(1)) for i, e in enumerate(EMOTIONS))
+        else:
+            columns[c] = df[c].to_numpy()
+
+    return pd.DataFrame(columns, index=df.index, copy=False)
+
+
+def emotion_columns(df):
+
+    """
+    @param df: input dataframe, packed or not
+    @return: the columns holding the emotions of a frame: [EMOTION_CODE] or EMOTIONS
+    """
+
+    return [EMOTION_CODE] if EMOTION_CODE in df.columns else EMOTIONS
+
+
+def row_fingerprint(df, columns):
+
+    """
+    Packs integer columns into 64-bit words. Each column is shifted by its minimum and takes as many bits as its
+    range requires, so equal fingerprints mean equal rows.
+
+    @param df: input dataframe
+    @param columns: integer columns to pack
+    @return: list of uint64 arrays (a single one for the id/time/emotion columns of a typical video)
+    """
+
+    words, word, used = [], np.zeros(len(df), dtype=np.uint64), 0
+    for c in columns:
+        x = df[c].to_numpy().astype(np.int64)
+        low = x.min() if len(x) else 0
+        width = int(x.max() - low).bit_length() if len(x) else 0
+        if used + width > 64:
+            words.append(word)
+            word, used = np.zeros(len(df), dtype=np.uint64), 0
+        # in place: one temporary column at a time
+        x -= low
+        x = x.view(np.uint64)
+        x <<= np.uint64(used)
+        word |= x
+        used += width
+    words.append(word)
+
+    return words
+
+
+# rows duplicated on these columns are dropped. Rows duplicated on these columns + frame_no are a subset of them,
+# thus a single pass is enough
+DUPLICATE_COLUMNS = ['video_id', 'subject_id', 'millisecond_from_start'] + EMOTIONS
+
+
+@profiler.profile
 def remove_duplicates(df_input):
 
     """
@@ -37,45 +169,297 @@ def remove_duplicates(df_input):
     @return: a copy without duplicates
     """
 
-    df = df_input.copy()
-    size_i = df.shape[0]
+    size_i = df_input.shape[0]
+    columns = DUPLICATE_COLUMNS[:-len(EMOTIONS)] + emotion_columns(df_input)
 
-    cols = ['video_id', 'subject_id', 'frame_no', 'millisecond_from_start',
-               'positive_1', 'positive_2', 'negative_1', 'negative_2', 'negative_3']
-    df.drop_duplicates(cols, inplace=True)
+    if all(pd.api.types.is_integer_dtype(df_input[c]) for c in columns):
+        words = row_fingerprint(df_input, columns)
+        key = pd.Series(words[0]) if len(words) == 1 else pd.DataFrame(dict(enumerate(words)))
+        duplicated = key.duplicated().to_numpy()
+        del words, key
+    else:
+        duplicated = df_input.duplicated(columns).to_numpy()
 
-    cols = ['video_id', 'subject_id', 'millisecond_from_start',
-               'positive_1', 'positive_2', 'negative_1', 'negative_2', 'negative_3']
-    df.drop_duplicates(cols, inplace=True)
+    df = df_input[~duplicated]
 
     size_f = df.shape[0]
-    print('{} ({}%) duplicates dropped'.format(size_i - size_f, round((size_i - size_f)/size_i*100,1)))
+    percent = round((size_i - size_f)/size_i*100,1) if size_i else 0
+    profiler.message('{} ({}%) duplicates dropped'.format(size_i - size_f, percent))
 
     return df
 
 
+class StreamingDeduplicator:
+
+    """
+    Removes duplicates from a stream of typed chunks (see read_video). Fingerprints of already seen frames are kept per
+    subject; with bounded=True the chunks are expected to be sorted by subject and only the last subject of a chunk
+    is remembered, as it is the only one which can continue in the next chunk.
+    """
+
+    def __init__(self, bounded=True):
+        self.bounded = bounded
+        self.seen = {}
+        self.size_i = 0
+        self.size_f = 0
+
+    def process(self, df):
+
+        """
+        Removes duplicates of a chunk, including the frames already seen in previous chunks
+
+        @param df: a typed chunk
+        @return: the chunk without duplicates
+        """
+
+        # millisecond_from_start and emotions of a frame fit exactly into 37 bits
+        fp = df['millisecond_from_start'].to_numpy().astype(np.uint32).astype(np.uint64) << np.uint64(5) | \
+            pack_emotions(df).astype(np.uint64)
+        video, subject = df['video_id'].to_numpy(), df['subject_id'].to_numpy()
+        keep = ~pd.DataFrame({'video_id': video, 'subject_id': subject, 'fp': fp}).duplicated().to_numpy()
+
+        # frames of subjects continuing from the previous chunks; without bounds the rows of the chunk are grouped by
+        # subject once and only the subjects of the chunk are looked up
+        if self.bounded:
+            groups = dict((key, np.flatnonzero((video == key[0]) & (subject == key[1]))) for key in self.seen)
+        else:
+            groups = pd.DataFrame({'video_id': video, 'subject_id': subject}).groupby(
+                ['video_id', 'subject_id'], sort=False).indices
+        for key, rows in groups.items():
+            if key in self.seen:
+                rows = rows[keep[rows]]
+                keep[rows] = ~np.isin(fp[rows], self.seen[key])
+
+        if len(df):
+            if self.bounded:
+                last = (video[-1], subject[-1])
+                rows = keep & (video == last[0]) & (subject == last[1])
+                self.seen = {last: np.concatenate([self.seen.get(last, fp[:0]), fp[rows]])}
+            else:
+                for key, rows in groups.items():
+                    self.seen[key] = np.concatenate([self.seen.get(key, fp[:0]), fp[rows[keep[rows]]]])
+
+        self.size_i += len(df)
+        self.size_f += int(keep.sum())
+
+        return df[keep]
+
+    def report(self):
+
+        """
+        Prints the number of dropped duplicates
+        """
+
+        size_i, size_f = self.size_i, self.size_f
+        percent = round((size_i - size_f)/size_i*100,1) if size_i else 0
+        profiler.message('{} ({}%) duplicates dropped'.format(size_i - size_f, percent))
+
+
+def data_files(path):
+
+    """
+    Finds all video files matching the data path pattern, ordered by video file number
+
+    @param path: data_path or data_path_jup
+    @return: a dict {video file number: path to video}
+    """
+
+    files = {}
+    for f in glob.glob(path('*')):
+        match = re.search(r'_(\d+)\.csv$', f)
+        if match:
+            files[int(match.group(1))] = f
+
+    return dict(sorted(files.items()))
+
+
+class NoValueProfile:
+
+    """
+    Missing data report collected while parsing (see read_video): counts of non-numeric tokens per column and counts of
+    co-missingness patterns (sets of columns missing together) per video file
+    """
+
+    def __init__(self):
+        self.tokens = {}
+        self.patterns = {}
+        self.rows = {}
+
+    def update(self, video_file, chunk, missing):
+
+        """
+        Adds a parsed chunk to the report
+
+        @param video_file: video file number
+        @param chunk: raw chunk parsed with 'No value' as nan
+        @param missing: boolean array (rows, COLUMNS), True for non-numeric entries
+        """
+
+        tokens = self.tokens.setdefault(video_file, {c: {} for c in COLUMNS})
+        for j, c in enumerate(COLUMNS):
+            n = int(missing[:, j].sum())
+            if not n:
+                continue
+            x = chunk[c]
+            other = x[missing[:, j] & x.notna().to_numpy()].value_counts()
+            for token, count in [(NO_VALUE, n - other.sum())] + list(other.items()):
+                if count:
+                    tokens[c][token] = tokens[c].get(token, 0) + int(count)
+
+        codes = missing.astype(np.int64) @ (1 << np.arange(len(COLUMNS)))
+        patterns = np.bincount(codes, minlength=2 ** len(COLUMNS))
+        self.patterns[video_file] = self.patterns.get(video_file, 0) + patterns
+        self.rows[video_file] = self.rows.get(video_file, 0) + len(chunk)
+
+    def token_report(self):
+
+        """
+        @return: a dataframe with count and percentage of each non-numeric token per video file and column
+        """
+
+        df = pd.DataFrame([(v, c, token, count) for v, tokens in self.tokens.items() for c in COLUMNS
+                           for token, count in tokens[c].items()],
+                          columns=['video_file', 'column', 'token', 'count'])
+        df['percent'] = (df['count'] / df['video_file'].map(self.rows) * 100).round(1)
+
+        return df
+
+    def pattern_report(self):
+
+        """
+        @return: a dataframe with count and percentage of rows per video file and set of missing columns
+        """
+
+        rows = []
+        for v, patterns in self.patterns.items():
+            for code in np.flatnonzero(patterns):
+                columns = [c for j, c in enumerate(COLUMNS) if code >> j & 1]
+                rows.append((v, ', '.join(columns) if columns else '-', int(patterns[code]),
+                             round(patterns[code] / self.rows[v] * 100, 1)))
+
+        return pd.DataFrame(rows, columns=['video_file', 'missing_columns', 'count', 'percent'])
+
+    def show(self):
+
+        """
+        Shows non-numeric values and their proportion for each video and column (as no_value) and co-missingness
+        patterns
+        """
+
+        tokens = self.token_report()
+        for v in self.rows:
+            print('video {}'.format(v))
+            for c in COLUMNS:
+                x = tokens[(tokens['video_file'] == v) & (tokens['column'] == c)]
+                print(list(x['token']), "{}%".format(round(x['count'].sum() / self.rows[v] * 100)))
+            print('')
+
+        print('Missing columns patterns:')
+        print(self.pattern_report().to_string(index=False), '\n')
+
+
+def read_video(file, chunksize=10 ** 6, profile=None, video_file=None, packed=False):
+
+    """
+    Reads a video file chunk by chunk directly into compact dtypes. Non-numeric entries ('No value') are mapped to
+    NO_VALUE_INT (int32 columns) or 0 (uint8 emotion columns) and labeled in 'no_value_id' and 'no_value_emotion'.
+
+    @param file: path to a video file
+    @param chunksize: number of rows parsed at once
+    @param profile: NoValueProfile to update with each chunk, or None
+    @param video_file: video file number used in the profile
+    @param packed: True - the emotions of each chunk are packed into one column (see pack_frame)
+    @return: generator of typed dataframes
+    """
+
+    reader = pd.read_csv(file, usecols=COLUMNS, na_values=[NO_VALUE], keep_default_na=False, chunksize=chunksize)
+    for chunk in reader:
+        df = pd.DataFrame(index=pd.RangeIndex(len(chunk)))
+        missing = np.empty((len(chunk), len(COLUMNS)), dtype=bool)
+        for j, c in enumerate(COLUMNS):
+            x = chunk[c]
+            if x.dtype == object:
+                # non-numeric tokens other than 'No value'
+                x = pd.to_numeric(x, errors='coerce')
+            missing[:, j] = x.isna().to_numpy()
+            df[c] = x.fillna(NO_VALUE_INT if DTYPES[c] == 'int32' else 0).to_numpy(dtype=DTYPES[c])
+        df['no_value_id'] = missing[:, COLUMNS.index('subject_id')].astype('uint8')
+        df['no_value_emotion'] = missing[:, COLUMNS.index('positive_1')].astype('uint8')
+        if profile is not None:
+            profile.update(video_file, chunk, missing)
+        yield pack_frame(df) if packed else df
+
+
+@profiler.profile
+def load_videos(path, chunksize=10 ** 6, profile=None, packed=False):
+
+    """
+    Loads all video files into a single typed dataframe
+
+    @param path: data_path or data_path_jup
+    @param chunksize: number of rows parsed at once
+    @param profile: NoValueProfile collecting the missing data report while parsing, or None
+    @param packed: True - one packed emotion column instead of the five emotion columns (see pack_frame)
+    @return: a dataframe with all videos + an index (video file number -> 'file', 'start', 'stop' rows)
+    """
+
+    profiler.message('Load data')
+
+    chunks, index, start = [], [], 0
+    for i, file in data_files(path).items():
+        rows = 0
+        for chunk in read_video(file, chunksize, profile, i, packed):
+            chunks.append(chunk)
+            rows += len(chunk)
+        index.append((i, file, start, start + rows))
+        start += rows
+
+    df = pd.concat(chunks, ignore_index=True) if chunks else \
+        pd.DataFrame({c: pd.Series(dtype=t) for c, t in list(DTYPES.items()) + [('no_value_id', 'uint8'),
+                                                                                 ('no_value_emotion', 'uint8')]})
+    if packed:
+        df = pack_frame(df)
+    index = pd.DataFrame(index, columns=['video_file', 'file', 'start', 'stop']).set_index('video_file')
+
+    profiler.message('Data loaded \n')
+
+    return df, index
+
+
+def video_frames(df, index):
+
+    """
+    Returns per-video views of a dataframe loaded by load_videos
+
+    @param df: a dataframe returned by load_videos
+    @param index: an index returned by load_videos
+    @return: generator of dataframes, one per video file
+    """
+
+    for start, stop in zip(index['start'], index['stop']):
+        yield df.iloc[start:stop]
+
+
 def load_data(path):
 
     """
     Loads video data
 
-    @param path: path to a video file
-    @return: dataframes, corresponding to each video + a full dataframe
+    @param path: data_path or data_path_jup; all video files matching it are loaded (see data_files)
+    @return: a full dataframe + dataframes, corresponding to each video file
     """
 
-    print('Load data')
-
-    df1 = pd.read_csv(path(1))
-    df2 = pd.read_csv(path(2))
-    df3 = pd.read_csv(path(3))
-    for df in [df1, df2, df3]:
-        df = remove_duplicates(df)
+    profiler.message('Load data')
 
-    df = pd.concat([df1, df2, df3], ignore_index=True)
+    dfs = [pd.read_csv(file) for file in data_files(path).values()]
+    bounds = np.cumsum([0] + [len(x) for x in dfs])
+    df = pd.concat(dfs, ignore_index=True)
+    del dfs
 
-    print('Data loaded \n')
+    profiler.message('Data loaded \n')
 
-    return df, df1, df2, df3
+    # per-video dataframes are row slices of the full dataframe
+    return (df,) + tuple(df.iloc[i:j] for i, j in zip(bounds[:-1], bounds[1:]))
 
 
 def no_value(df_input):
@@ -86,16 +470,17 @@ def no_value(df_input):
     @param df_input: input dataframe
     """
 
-    df = df_input.copy()
+    for column in df_input.columns:
+        x = df_input[column]
+        if pd.api.types.is_numeric_dtype(x):
+            idx = x.isna().to_numpy()
+        else:
+            idx = pd.to_numeric(x, errors='coerce').isna().to_numpy()
+        no_val = list(set(x[idx]))
+        print(no_val, "{}%".format(round(idx.sum() / df_input.shape[0] * 100)))
 
-    for column in df.columns:
-        idx = pd.to_numeric(df[column], errors='coerce').isna()
-        no_val = list(set(df[idx][column]))
-        no_val_len = len(df[idx][column])
-        print(no_val, "{}%".format(round(no_val_len / df.shape[0] * 100)))
 
-
-def replace_no_value_id_sub(df_input, method='preceding'):
+def replace_no_value_id_sub(df_input, method='preceding', inplace=False):
 
     """
     Replaces 'No value' in video_id & subject_id in df_input. This function is an auxiliary function and is used in
@@ -103,21 +488,23 @@ def replace_no_value_id_sub(df_input, method='preceding'):
 
     @param df_input: input dataframe
     @param method: 'preceding' or 'following'; replace by the preceding or next column value
+    @param inplace: if True, modify df_input; otherwise only the id columns of the result are new
     @return: a dataframe with replaced mising values
     """
 
-    df = df_input.copy()
+    df = df_input if inplace else df_input.copy(deep=False)
     for c in ['video_id', 'subject_id']:
-        df[c] = pd.to_numeric(df[c], errors='coerce', downcast='integer')
+        x = pd.to_numeric(df[c], errors='coerce', downcast='integer')
         if method == 'preceding':
-            df[c].fillna(method='ffill', inplace=True)
+            x = x.ffill()
         if method == 'following':
-            df[c].fillna(method='bfill', inplace=True)
-        df[c] = df[c].astype('int32').astype('str')
+            x = x.bfill()
+        df[c] = x.astype('int32').astype('str')
 
     return df
 
 
+@profiler.profile
 def replace_no_value_id(df_input):
 
     """
@@ -125,26 +512,26 @@ def replace_no_value_id(df_input):
         previous/next value.
 
         @param df_input: input dataframe
-        @return:a dataframe with replaced missing values
+        @return: id columns of missing + neighbour entries with replaced missing values (to be used in update)
     """
 
-    df = df_input.copy()
+    # restrict data frame to missing + neighbour values and the columns used
+    no_value = df_input['no_value_id']
+    missing = no_value.to_numpy() == 1
+    idx = missing.copy()
+    idx[1:] |= missing[:-1]
+    idx[:-1] |= missing[1:]
+    # rows first: selecting the columns first would copy them for all rows
+    df = df_input.loc[idx][ID_COLUMNS + ['frame_no']]
 
     # label missing entries
-    df['no_value'] = df['no_value_id']
-
-    # restrict data frame to missing + neighbour values
-    df = df[(df['no_value'] == 1) | (df['no_value'].shift() == 1) | (df['no_value'].shift(-1) == 1)]
-
-    # count consecutive missing entries (=1); e.g., [0,0,1,0,1,1,0,0] will correspond to [0,0,1,0,2,2,0,0]
-    group = df.groupby((df['no_value'] != df['no_value'].shift()).cumsum())
-    df['no_value_count'] = group['no_value'].transform('sum')
+    df['no_value'] = no_value[idx]
 
     # replace missing values by preceding value
-    df = replace_no_value_id_sub(df, 'preceding')
+    df = replace_no_value_id_sub(df, 'preceding', inplace=True)
 
     # compute difference between current and previous value for 'frame_no'
-    df['frame_no_diff'] = df.groupby(['subject_id'])['frame_no'].transform(lambda x: x.diff().abs())
+    df['frame_no_diff'] = df.groupby('subject_id')['frame_no'].diff().abs()
 
     # if any of frame_no_diff in a group of consequent missing values not eq 1 => label the whole group with this value
     group = df.groupby((df['no_value'] != df['no_value'].shift()).cumsum())
@@ -158,52 +545,230 @@ def replace_no_value_id(df_input):
     df['no_value'] = (df['subject_id'] == 'No value').astype('int')
 
     # replace missing values by following value
-    df = replace_no_value_id_sub(df, 'following')
+    df = replace_no_value_id_sub(df, 'following', inplace=True)
 
     # compute difference between current and following value for 'frame_no'
-    df['frame_no_diff'] = df.groupby(['subject_id'])['frame_no'].transform(lambda x: x.diff().abs().shift(-1))
+    df['frame_no_diff'] = df.groupby('subject_id')['frame_no'].diff(-1).abs()
 
     # if frame number did not change by 1, change back to 'No value'
     for c in ['video_id', 'subject_id']:
         df.loc[(df['frame_no_diff'] != 1) & (df['no_value'] == 1), c] = 'No value'
 
     if set(df[df['no_value'] == 1]['frame_no_diff']) == {1}:
-        print('All id missing values were successfully replaced \n')
+        profiler.message('All id missing values were successfully replaced \n')
+    else:
+        profiler.message('Not all missing values were replaced. Investigate manually! \n')
+
+    return df[ID_COLUMNS]
+
+
+def fill_id_gaps(ids, frame_no, missing):
+
+    """
+    Array version of replace_no_value_id. A run of consecutive missing entries takes the preceding value if
+    'frame_no' changes by 1 through the whole run (including the step from the preceding row). Entries of the
+    remaining runs take the following value if 'frame_no' changes by 1 with respect to the next row.
+
+    @param ids: list of integer arrays to fill (e.g. video_id, subject_id)
+    @param frame_no: integer array of frame numbers
+    @param missing: boolean array, True for missing entries
+    @return: list of filled arrays + boolean array of entries which are still missing
+    """
+
+    n = len(missing)
+    missing = np.asarray(missing, dtype=bool)
+    frame_no = np.asarray(frame_no)
+
+    # run-length encoding of missing entries: run i covers rows starts[i]:stops[i]
+    edges = np.diff(missing.view(np.int8), prepend=np.int8(0), append=np.int8(0))
+    starts = np.flatnonzero(edges == 1)
+    stops = np.flatnonzero(edges == -1)
+    del edges
+    rows = np.flatnonzero(missing)
+    run = np.repeat(np.arange(len(starts)), stops - starts)
+
+    # |frame_no[k] - frame_no[k-1]| (step into a missing row) and |frame_no[k+1] - frame_no[k]| (step out of it),
+    # nan outside of the frame; only missing rows are computed
+    def step(k):
+        return np.abs(frame_no[k + 1].astype(np.int64) - frame_no[k])
+
+    step_in = np.full(len(rows), np.nan)
+    step_in[rows > 0] = step(rows[rows > 0] - 1)
+    step_out = np.full(len(rows), np.nan)
+    step_out[rows < n - 1] = step(rows[rows < n - 1])
+
+    # preceding value: the whole run should change by 1 (a run at the very beginning has no preceding value)
+    if len(starts):
+        run_max = np.maximum.reduceat(step_in, np.cumsum(stops - starts) - (stops - starts))
     else:
-        print('Not all missing values were replaced. Investigate manually! \n')
+        run_max = np.empty(0)
+    preceding = (run_max == 1)[run]
+
+    # following value: the next frame should change by 1 (nan for the last row)
+    following = ~preceding & (step_out == 1)
 
-    return df[df.columns[:-3]]
+    source = np.where(preceding, starts[run] - 1, stops[run])
+    resolved = preceding | following
+    filled = []
+    for x in ids:
+        x = np.array(x, copy=True)
+        x[rows[resolved]] = x[source[resolved]]
+        filled.append(x)
 
+    still_missing = np.zeros(n, dtype=bool)
+    still_missing[rows[~resolved]] = True
 
-def plot_no_value_emotion(df_input):
+    return filled, still_missing
+
+
+@profiler.profile
+def replace_no_value_id_typed(df_input, inplace=False):
+
+    """
+    Replaces missing video_id & subject_id in a dataframe loaded by load_videos, with the same rules as in
+    replace_no_value_id
+
+    @param df_input: input dataframe with 'no_value_id' labels
+    @param inplace: if True, modify df_input; otherwise only the id columns of the result are new
+    @return: a dataframe with replaced missing values
+    """
+
+    ids, still_missing = fill_id_gaps([df_input[c].to_numpy() for c in ID_COLUMNS], df_input['frame_no'].to_numpy(),
+                                      df_input['no_value_id'].to_numpy() != 0)
+    columns = dict(zip(ID_COLUMNS, ids), no_value_id=still_missing.view(np.uint8))
+
+    if inplace:
+        df = df_input
+        for c, x in columns.items():
+            df[c] = x
+    else:
+        # the other columns are views: setting columns of a shallow copy would copy the rest of their blocks
+        df = pd.DataFrame({c: columns[c] if c in columns else df_input[c].to_numpy() for c in df_input.columns},
+                          index=df_input.index, copy=False)
+
+    if not still_missing.any():
+        profiler.message('All id missing values were successfully replaced \n')
+    else:
+        profiler.message('Not all missing values were replaced. Investigate manually! \n')
+
+    return df
+
+
+# rows binned at once by histograms_by_video: temporaries are of a fixed size rather than of all rows
+HISTOGRAM_CHUNK = 2 ** 16
+
+
+def histograms_by_video(values, video_id, bins):
+
+    """
+    Computes histograms of values for each video in one pass, binning chunks of rows of all videos at once. Each
+    video has its own range split into bins (as np.histogram).
+
+    @param values: numeric array
+    @param video_id: array of video ids
+    @param bins: number of bins
+    @return: a dict {video_id: (counts, bin edges)}
+    """
+
+    values, video_id = np.asarray(values), np.asarray(video_id)
+    chunks = [slice(k, k + HISTOGRAM_CHUNK) for k in range(0, len(values), HISTOGRAM_CHUNK)]
+    ids = np.unique(np.concatenate([np.unique(video_id[c]) for c in chunks])) if chunks else video_id[:0]
+
+    # row of each video: a lookup table for integer ids within the size of a chunk, a binary search otherwise
+    if ids.dtype.kind in 'iu' and len(ids) and ids[-1] - ids[0] < HISTOGRAM_CHUNK:
+        lookup = np.zeros(int(ids[-1] - ids[0]) + 1, dtype=np.intp)
+        lookup[ids - ids[0]] = np.arange(len(ids))
+        video_codes = lambda c: lookup[video_id[c] - ids[0]]
+    else:
+        video_codes = lambda c: np.searchsorted(ids, video_id[c])
+
+    # range of each video; an empty range is widened as in np.histogram
+    low, high = np.full(len(ids), np.inf), np.full(len(ids), -np.inf)
+    for c in chunks:
+        codes, x = video_codes(c), values[c].astype(np.float64)
+        np.minimum.at(low, codes, x)
+        np.maximum.at(high, codes, x)
+    low[low == high] -= 0.5
+    high[low + 0.5 == high] += 0.5
+    edges = np.linspace(low, high, bins + 1, axis=1)
+    flat = edges.ravel()
+
+    # bins of np.histogram: a scaled index corrected by the comparison with the edges
+    counts = np.zeros(len(ids) * bins, dtype=np.int64)
+    for c in chunks:
+        codes, x = video_codes(c), values[c].astype(np.float64)
+        idx = ((x - low[codes]) / (high - low)[codes] * bins).astype(np.intp)
+        idx[idx == bins] -= 1
+        first = codes * (bins + 1)
+        idx -= x < flat[first + idx]
+        idx += (x >= flat[first + idx + 1]) & (idx != bins - 1)
+        counts += np.bincount(codes * bins + idx, minlength=len(counts))
+    counts = counts.reshape(len(ids), bins)
+
+    return {id: (counts[i], edges[i]) for i, id in enumerate(ids)}
+
+
+def _plot_histogram(ax, counts, edges):
+    # draws a precomputed histogram
+    ax.hist(edges[:-1], bins=edges, weights=counts, edgecolor="k")
+
+
+def _figure(nrows, ncols, figsize, output=None):
+    # figures written to a file are not registered in pyplot, so they are released once saved;
+    # matplotlib is imported on the first plot only
+    if output is None:
+        import matplotlib.pyplot as plt
+        fig, axes = plt.subplots(nrows, ncols, figsize=figsize, squeeze=False)
+    else:
+        from matplotlib.figure import Figure
+        fig = Figure(figsize=figsize)
+        axes = fig.subplots(nrows, ncols, squeeze=False)
+    return fig, axes
+
+
+def _video_axes(n, nrows=1, figsize=(20, 5), output=None):
+    # a grid with one column per video (at most 3 per row), repeated nrows times
+    ncols = max(min(n, 3), 1)
+    rows = max(-(-n // 3), 1)
+    fig, axes = _figure(nrows * rows, ncols, (figsize[0], figsize[1] * nrows * rows), output)
+    groups = [axes[r * rows:(r + 1) * rows].ravel() for r in range(nrows)]
+    for ax in (ax for g in groups for ax in g[n:]):
+        ax.set_visible(False)
+    return fig, groups
+
+
+def _save(fig, output):
+    # output format is taken from the file extension (e.g. .png, .svg)
+    if output is not None:
+        fig.savefig(output)
+
+
+def plot_no_value_emotion(df_input, output=None):
 
     """
         Plots statistics on missing emotion values
 
         @param df_input: input dataframe
+        @param output: None - show the plot; a file path - save the plot to the file
     """
 
-    df = df_input.copy()
+    df = df_input
 
-    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(20, 7))
+    fig, ((ax1, ax2),) = _figure(1, 2, (20, 7), output)
     fig.suptitle("Missing emotion values distribution", fontsize=20)
 
-    # total per video
-    group = df.groupby('video_id')['no_value_emotion']
-    x = group.value_counts().unstack()
-    x = x.divide(x.sum(axis=1)/100, axis=0).round(1)
+    # total per video, from the runs of subjects
+    runs, proportion = _subject_no_value_emotion(df)
+    x = runs.groupby('video_id')[['frames', 'missing']].sum()
+    x = (x['missing'] / x['frames'] * 100).round(1)
 
     ax1.set_title('per video', fontsize=15)
     ax1.set(xlabel='Video ID', ylabel='Frequency, %')
-    x[1].plot(ax=ax1, kind='bar', rot=0)
+    x.plot(ax=ax1, kind='bar', rot=0)
 
     # total per subject
-    group = df.groupby('subject_id')['no_value_emotion']
-    x = group.value_counts().unstack()
-    x = x.divide(x.sum(axis=1)/100, axis=0).round(1)
-    x = x.fillna(0).astype('int32')
-    x['cat'] = pd.cut(x[1], bins=5, labels=None)
-    x = x['cat'].value_counts().sort_index()
+    x = pd.cut(pd.Series(proportion.astype('int32')), bins=5, labels=None)
+    x = x.value_counts().sort_index()
     x = x.divide(x.sum()/100).round(1)
 
     ax2.set_title('per subject', fontsize=15)
@@ -216,7 +781,77 @@ def plot_no_value_emotion(df_input):
             ax.annotate(str(p.get_height()), (p.get_x()+p.get_width()/2., p.get_y()+p.get_height()/2.),
                         ha='center', va='center')
 
+    _save(fig, output)
+
+
+def _subject_no_value_emotion(df_input):
+    # runs of rows of the same (video_id, subject_id) ('subject' - factorized subject_id, number of 'frames' and of
+    # frames with 'missing' emotion data) and proportion (in %) of missing emotion data of each subject. Frames of a
+    # subject are usually contiguous, so temporaries scale with the number of runs and of frames without emotions
+    # rather than with the number of rows
+    video_id, subject_id = df_input['video_id'].to_numpy(), df_input['subject_id'].to_numpy()
+    new = np.ones(len(df_input), dtype=bool)
+    new[1:] = subject_id[1:] != subject_id[:-1]
+    new[1:] |= video_id[1:] != video_id[:-1]
+    starts = np.flatnonzero(new)
+    del new
+
+    missing = np.searchsorted(starts, np.flatnonzero(df_input['no_value_emotion'].to_numpy()), side='right') - 1
+    codes, _ = pd.factorize(subject_id[starts])
+    runs = pd.DataFrame({'video_id': video_id[starts], 'subject': codes,
+                         'frames': np.diff(np.append(starts, len(df_input))),
+                         'missing': np.bincount(missing, minlength=len(starts))})
+
+    frames = np.bincount(codes, weights=runs['frames'].to_numpy())
+    proportion = np.round(np.bincount(codes, weights=runs['missing'].to_numpy()) / frames * 100, 1)
+
+    return runs, proportion
+
+
+def _sweep(runs, proportion, thresholds):
+    # sweep_no_value_emotion on the output of _subject_no_value_emotion
+
+    # one row per (video_id, subject_id) pair
+    pairs = runs[['video_id', 'subject']].drop_duplicates()
+    removed = pd.DataFrame(proportion[pairs['subject'].to_numpy()][:, None] > np.asarray(thresholds)[None, :],
+                           columns=list(thresholds))
+    removed['video_id'] = pairs['video_id'].to_numpy()
+
+    x = removed.groupby('video_id').mean()
+    x.loc['total'] = removed[list(thresholds)].mean()
+
+    return (x * 100).round(1)
+
+
+def no_value_emotion_proportion(df_input):
 
+    """
+    Computes proportion of missing emotion data for each subject
+
+    @param df_input: input dataframe with 'no_value_emotion' labels
+    @return: an array with the proportion (in %) of missing emotion data of each row's subject
+    """
+
+    runs, proportion = _subject_no_value_emotion(df_input)
+
+    return np.repeat(proportion[runs['subject'].to_numpy()], runs['frames'].to_numpy())
+
+
+def sweep_no_value_emotion(df_input, thresholds):
+
+    """
+    Computes proportion of subjects removed by remove_subjects_no_value_emotion for several thresholds at once
+
+    @param df_input: input dataframe with 'no_value_emotion' labels
+    @param thresholds: list of thresholds
+    @return: a dataframe with the proportion of removed subjects, in %; rows - video_id and 'total',
+             columns - thresholds
+    """
+
+    return _sweep(*_subject_no_value_emotion(df_input), thresholds)
+
+
+@profiler.profile
 def remove_subjects_no_value_emotion(df_input, threshold=30):
 
     """
@@ -227,112 +862,107 @@ def remove_subjects_no_value_emotion(df_input, threshold=30):
     @return: a dataframe without dropped subjects
     """
 
-    df = df_input.copy()
-
-    # calculate proportion of missing emotion data for each subject
-    group = df.groupby(['subject_id'])['no_value_emotion']
-    df['no_value_emotion_proportion'] = group.transform(lambda x: round(sum(x) / len(x) * 100, 1))
+    runs, proportion = _subject_no_value_emotion(df_input)
+    x = _sweep(runs, proportion, [threshold])[threshold]
 
-    # drop those subjects with proportion of missing data greater then a given threshold
-    df_i = df[['video_id', 'subject_id']].drop_duplicates()
-    df = df.drop(df[df['no_value_emotion_proportion'] > threshold].index)
-    df_f = df[['video_id', 'subject_id']].drop_duplicates()
+    profiler.message('Video ID \t Proportion of removed subjects per each video, in %')
+    profiler.message(x.drop('total').rename('removed'))
+    profiler.message('In total it was removed {}% of subjects \n'.format(x['total']))
 
-    # compute proportion of removed subjects: for each video and total
-    x = pd.DataFrame({'before': pd.Series(df_i['video_id'].value_counts()),
-                      'after': pd.Series(df_f['video_id'].value_counts())})
-    x['removed'] = round((x.before - x.after) / x.before * 100, 1)
-    x['removed_total'] = round((x.before.sum() - x.after.sum()) / x.before.sum() * 100, 1)
-
-    print('Video ID \t Proportion of removed subjects per each video, in %')
-    print(x['removed'])
-    print('In total it was removed {}% of subjects \n'.format(x['removed_total'].tolist()[0]))
-
-    return df
+    # per-subject decision broadcast to the rows
+    return df_input[np.repeat((proportion <= threshold)[runs['subject'].to_numpy()], runs['frames'].to_numpy())]
 
 
-def plot_num_of_frames(df_input, bins=(100, 50)):
+def plot_num_of_frames(df_input, bins=(100, 50), output=None):
 
     """
     Plots distribution of number of frames: for each video and for all videos
 
     @param df_input: an input dataframe
     @param bins: a tuple (a,b): a and b correspond to number of bins in hist plot; a - all videos, b - video i
+    @param output: None - show the plot; a file path - save the plot to the file
     """
 
-    df = df_input.copy()
-    df = df[['video_id', 'subject_id', 'no_of_frames']]
-    df.drop_duplicates(inplace=True)
+    # distinct rows are among the first rows of runs of equal values: only these rows are projected
+    columns = ['video_id', 'subject_id', 'no_of_frames']
+    new = np.zeros(len(df_input), dtype=bool)
+    new[:1] = True
+    for c in columns:
+        x = df_input[c].to_numpy()
+        new[1:] |= x[1:] != x[:-1]
+    df = df_input.iloc[np.flatnonzero(new)][columns].drop_duplicates()
 
-    fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(20, 11))
+    # histograms are computed before plotting
+    all_videos = np.histogram(df['no_of_frames'], bins=bins[0])
+    per_video = histograms_by_video(df['no_of_frames'], df['video_id'], bins[1])
+
+    fig, (axes,) = _video_axes(len(per_video) + 1, figsize=(20, 5.5), output=output)
     fig.suptitle("Number of frames distribution", fontsize=20)
 
     # all videos distribution
-    x = df[['no_of_frames']].copy()
-    ax1.hist(x, bins=bins[0], edgecolor="k")
-    ax1.set_title('all videos')
+    _plot_histogram(axes[0], *all_videos)
+    axes[0].set_title('all videos')
 
     # per video
-    y = df[['video_id', 'no_of_frames']].copy()
-    ids = set(y['video_id'])
-    for id, ax in zip(ids, [ax2, ax3, ax4]):
-        x = y[y['video_id'] == id]['no_of_frames'].copy()
-        ax.hist(x, bins=bins[1], edgecolor="k")
+    for (id, (counts, edges)), ax in zip(per_video.items(), axes[1:]):
+        _plot_histogram(ax, counts, edges)
         ax.set_title('Video ID: {}'.format(id))
 
+    _save(fig, output)
+
 
-def plot_time(df_input, bins=100):
+def plot_time(df_input, bins=100, output=None):
 
     """
     Plots time distribution for each video
 
     @param df_input: an input dataframe
     @param bins: int; number of bins in hist plot
+    @param output: None - show the plot; a file path - save the plot to the file
     """
 
-    df = df_input.copy()
-    df = df[['video_id', 'millisecond_from_start']]
+    per_video = histograms_by_video(df_input['millisecond_from_start'], df_input['video_id'], bins)
 
-    fig, (ax1, ax2, ax3) = plt.subplots(1, 3, figsize=(20, 5))
+    fig, (axes,) = _video_axes(len(per_video), output=output)
     fig.suptitle("Time distribution", fontsize=20)
 
     # per video
-    y = df[['video_id', 'millisecond_from_start']].copy()
-    ids = set(y['video_id'])
-    for id, ax in zip(ids, [ax1, ax2, ax3]):
-        x = y[y['video_id'] == id]['millisecond_from_start'].copy()
-        ax.hist(x, bins=bins, edgecolor="k")
+    for (id, (counts, edges)), ax in zip(per_video.items(), axes):
+        _plot_histogram(ax, counts, edges)
         ax.set_title('Video ID: {}'.format(id))
 
+    _save(fig, output)
+
 
-def plot_emotion_evolution(df_input, metrics=None, compare=None):
+def plot_emotion_evolution(df_input, metrics=None, compare=None, output=None):
 
     """
     Plots time evolution of emotions for each video
 
-    @param df_input: an input dataframe
+    @param df_input: an input dataframe with average metrics per video and time bin
     @param metrics: column names in df_input corresponding to computed metrics
     @param compare: None, 'videos', 'metrics'; None - plots emotion evolution for each video and chosen metrics,
                     'videos' - to compare videos, 'metrics' - to compare metrics
+    @param output: None - show the plot; a file path - save the plot to the file
     """
 
     if metrics is None:
         metrics = metrics_avg
 
-    df = df_input.copy()
-    df.rename(columns={'time_bin': 'Time, ms'}, inplace=True)
-    df.set_index('Time, ms', inplace=True)
-    ids = set(df['video_id'])
+    # projection on the plotted columns
+    df = df_input[['video_id', 'time_bin'] + list(metrics)].set_index('time_bin')
+    df.index.name = 'Time, ms'
+    ids = sorted(set(df['video_id']))
 
     # Plot emotions evolution (different metrics) for each video
     if compare == None:
 
-        fig, (ax1, ax2, ax3) = plt.subplots(1, 3, figsize=(20, 5))
+        fig, (axes,) = _video_axes(len(ids), output=output)
         fig.suptitle("Emotions evolution", fontsize=20)
 
-        for id, ax in zip(ids, [ax1, ax2, ax3]):
-            x = df[df['video_id'] == id].copy()
-            x[metrics].plot(ax=ax)
+        for id, ax in zip(ids, axes):
+            x = df.loc[df['video_id'] == id, metrics]
+            x.plot(ax=ax)
             ax.set_title('Video ID: {}'.format(id))
             ax.axhline(y=0, color='r', linestyle='-')
 
@@ -340,10 +970,10 @@ def plot_emotion_evolution(df_input, metrics=None, compare=None):
     if compare == 'videos':
 
         # plot
-        fig, (ax1, ax2, ax3) = plt.subplots(1, 3, figsize=(20, 5))
+        fig, (axes,) = _video_axes(len(metrics), output=output)
         fig.suptitle("Emotions evolution. Videos comparison.", fontsize=20)
 
-        for m, ax in zip(metrics, [ax1, ax2, ax3]):
+        for m, ax in zip(metrics, axes):
             df.groupby('video_id')[m].plot(legend=True, ax=ax, kind='line')
             ax.set_title(m)
             ax.axhline(y=0, color='r', linestyle='-')
@@ -354,23 +984,25 @@ def plot_emotion_evolution(df_input, metrics=None, compare=None):
         # shift metrics to zero
         metrics_centered = [m + '_centered' for m in metrics]
         for m in metrics:
-            df[m + '_centered'] = df.groupby('video_id')[m].apply(lambda x: x - x.mean())
+            df[m + '_centered'] = df[m] - df.groupby('video_id')[m].transform('mean')
 
         # compute difference between metrics
         df['delta_12'] = df[metrics[0] + '_centered'] - df[metrics[1] + '_centered']
         df['delta_13'] = df[metrics[0] + '_centered'] - df[metrics[2] + '_centered']
 
         # plot centered metrics and metrics differences
-        fig, ((ax1, ax2, ax3), (ax4, ax5, ax6)) = plt.subplots(2, 3, figsize=(20, 10))
+        fig, (axes_centered, axes_delta) = _video_axes(len(ids), nrows=2, output=output)
         fig.suptitle("Emotions evolution. Centered metrics & metrics difference.", fontsize=20)
 
-        for id, ax in zip(ids, [ax1, ax2, ax3]):
-            x = df[df['video_id'] == id].copy()
-            x[metrics_centered].plot(ax=ax)
+        for id, ax in zip(ids, axes_centered):
+            x = df.loc[df['video_id'] == id, metrics_centered]
+            x.plot(ax=ax)
             ax.axhline(y=0, color='r', linestyle='-')
             ax.set_title('Video ID: {}'.format(id))
 
-        for id, ax in zip(ids, [ax4, ax5, ax6]):
-            x = df[df['video_id'] == id].copy()
-            x[['delta_12', 'delta_13']].plot(ax=ax)
-            ax.axhline(y=0, color='r', linestyle='-')
\ No newline at end of file
+        for id, ax in zip(ids, axes_delta):
+            x = df.loc[df['video_id'] == id, ['delta_12', 'delta_13']]
+            x.plot(ax=ax)
+            ax.axhline(y=0, color='r', linestyle='-')
+
+    _save(fig, output)
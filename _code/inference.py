@@ -0,0 +1,132 @@
+"""
+Bootstrap confidence intervals and permutation tests for differences between videos. Subjects (not frames) are
+resampled: each subject is represented by its average metric, computed from per-subject sums and counts.
+"""
+
+
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from _code.emotions import aggregate, README_METRICS
+
+
+def subject_table(df, metrics=None):
+
+    """
+    Aggregates cleaned frames per subject
+
+    @param df: cleaned frames
+    @param metrics: features registered in emotions.FEATURES; None - README metrics
+    @return: a dataframe with video_id, subject_id, 'frames' and metric sums per subject
+    """
+
+    if metrics is None:
+        metrics = README_METRICS
+
+    return aggregate(df, ['video_id', 'subject_id'], metrics, mean=False).reset_index()
+
+
+def _batch_sizes(n_resamples, batch_size):
+    # resamples are split into fixed batches with their own seeds, so results do not depend on the number of workers
+    return [batch_size] * (n_resamples // batch_size) + ([n_resamples % batch_size] if n_resamples % batch_size else [])
+
+
+def _map(func, args, max_workers):
+    if max_workers == 1:
+        return [func(*a) for a in args]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(func, *zip(*args)))
+
+
+def _bootstrap_batch(values, size, seed):
+    rng = np.random.default_rng(seed)
+    return values[rng.integers(0, len(values), (size, len(values)))].mean(axis=1)
+
+
+def _permutation_batch(a, b, size, seed):
+    rng = np.random.default_rng(seed)
+    pooled = rng.permuted(np.tile(np.concatenate([a, b]), (size, 1)), axis=1)
+    return pooled[:, :len(a)].mean(axis=1) - pooled[:, len(a):].mean(axis=1)
+
+
+def _bootstrap_means(videos, n_resamples, seeds, batch_size, max_workers):
+    # resampled means of each video, one seed per video; the means of a video are drawn once and reused for every
+    # interval it takes part in
+    sizes = _batch_sizes(n_resamples, batch_size)
+    args = [(x, size, s) for (_, x), v_seed in zip(videos, seeds) for size, s in zip(sizes, v_seed.spawn(len(sizes)))]
+    results = iter(_map(_bootstrap_batch, args, max_workers))
+
+    return [np.concatenate([next(results) for _ in sizes]) for _ in videos]
+
+
+def bootstrap(subjects, metric, n_resamples=10000, alpha=0.05, seed=0, batch_size=1000, max_workers=1):
+
+    """
+    Computes bootstrap confidence intervals of the average metric of each video
+
+    @param subjects: output of subject_table
+    @param metric: metric name, e.g. 'metric_1'
+    @param n_resamples: number of bootstrap resamples
+    @param alpha: 1 - confidence level
+    @param seed: random seed
+    @param batch_size: number of resamples drawn at once
+    @param max_workers: number of worker processes; 1 - no process pool, None - number of cores
+    @return: a dataframe indexed by video_id with 'mean', 'ci_low', 'ci_high' and 'subjects'
+    """
+
+    values = (subjects[metric] / subjects['frames']).groupby(subjects['video_id'])
+    videos = [(v, x.to_numpy()) for v, x in values]
+    seeds = np.random.SeedSequence(seed).spawn(len(videos))
+
+    rows = []
+    for (v, x), means in zip(videos, _bootstrap_means(videos, n_resamples, seeds, batch_size, max_workers)):
+        rows.append({'video_id': v, 'mean': x.mean(), 'ci_low': np.quantile(means, alpha / 2),
+                     'ci_high': np.quantile(means, 1 - alpha / 2), 'subjects': len(x)})
+
+    return pd.DataFrame(rows).set_index('video_id')
+
+
+def permutation_test(subjects, metric, n_resamples=10000, alpha=0.05, seed=0, batch_size=1000, max_workers=1):
+
+    """
+    Two-sided permutation test of the difference of average metrics for each pair of videos, with a bootstrap
+    confidence interval of the difference. Subjects of each video are resampled once and the resampled means are
+    paired across videos, so the bootstrap costs one set of index matrices per video rather than per pair.
+
+    @param subjects: output of subject_table
+    @param metric: metric name, e.g. 'metric_1'
+    @param n_resamples: number of permutations and of bootstrap resamples
+    @param alpha: 1 - confidence level of the interval
+    @param seed: random seed
+    @param batch_size: number of resamples drawn at once
+    @param max_workers: number of worker processes; 1 - no process pool, None - number of cores
+    @return: a dataframe with 'video_a', 'video_b', 'difference' (a - b), 'ci_low', 'ci_high' and 'p_value' for each
+             pair
+    """
+
+    values = dict((v, x.to_numpy()) for v, x in (subjects[metric] / subjects['frames']).groupby(subjects['video_id']))
+    pairs = list(itertools.combinations(values, 2))
+    sizes = _batch_sizes(n_resamples, batch_size)
+    # video seeds are spawned after the pair seeds, so p-values do not depend on the bootstrap
+    root = np.random.SeedSequence(seed)
+    seeds = root.spawn(len(pairs))
+    videos = list(values.items())
+    means = dict(zip(values, _bootstrap_means(videos, n_resamples, root.spawn(len(videos)), batch_size, max_workers)))
+
+    args = [(values[a], values[b], size, s) for (a, b), p_seed in zip(pairs, seeds)
+            for size, s in zip(sizes, p_seed.spawn(len(sizes)))]
+    results = iter(_map(_permutation_batch, args, max_workers))
+
+    rows = []
+    for a, b in pairs:
+        differences = np.concatenate([next(results) for _ in sizes])
+        observed = values[a].mean() - values[b].mean()
+        p_value = (np.sum(np.abs(differences) >= abs(observed) - 1e-12) + 1) / (len(differences) + 1)
+        resampled = means[a] - means[b]
+        rows.append({'video_a': a, 'video_b': b, 'difference': observed, 'ci_low': np.quantile(resampled, alpha / 2),
+                     'ci_high': np.quantile(resampled, 1 - alpha / 2), 'p_value': p_value})
+
+    return pd.DataFrame(rows, columns=['video_a', 'video_b', 'difference', 'ci_low', 'ci_high', 'p_value'])
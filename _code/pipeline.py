@@ -0,0 +1,113 @@
+"""
+Cleaning pipeline: runs the cleaning steps of analysis_draft.py on each video file independently. Each subject
+watched only one video, so the video files can be cleaned in parallel and merged afterwards.
+"""
+
+
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from _code.functions import NO_VALUE, data_files, replace_no_value_id, remove_subjects_no_value_emotion, \
+    remove_duplicates
+from _code.profiling import Profiler, profiler
+
+
+SORT_COLUMNS = ['video_id', 'subject_id', 'frame_no', 'millisecond_from_start']
+
+
+def clean_video(file, threshold=30, trace_memory=False):
+
+    """
+    Runs the cleaning chain on a single video file. Frames with missing ids which could not be replaced are dropped;
+    their number is rows_in - rows_out of the 'drop_unresolved_id' stage.
+
+    @param file: path to a video file
+    @param threshold: threshold passed to remove_subjects_no_value_emotion
+    @param trace_memory: if True, record bytes allocated by each stage (slower)
+    @return: a cleaned dataframe + a list of stage records (see profiling.Profiler)
+    """
+
+    stages = Profiler(trace_memory=trace_memory)
+
+    def timed(stage, func, *args):
+        rows_in = len(args[0]) if isinstance(args[0], pd.DataFrame) else None
+        with stages.stage(stage, rows_in=rows_in, file=file) as record:
+            result = func(*args)
+            record['rows_out'] = len(result)
+        return result
+
+    df = timed('load_data', pd.read_csv, file)
+    columns = list(df.columns)
+
+    def replace_id(df):
+        df['no_value_id'] = df['subject_id'].apply(lambda x: 1 if str(x) == 'No value' else 0)
+        df['no_value_emotion'] = df['positive_1'].apply(lambda x: 1 if str(x) == 'No value' else 0)
+        df.update(replace_no_value_id(df))
+        return df
+
+    def drop_unresolved_id(df):
+        # frames whose ids could not be replaced are dropped (as in streaming.clean_chunk): to_int needs numeric ids
+        unresolved = ((df['video_id'].astype(str) == NO_VALUE) | (df['subject_id'].astype(str) == NO_VALUE)).to_numpy()
+        if unresolved.any():
+            profiler.message('{} frames with missing ids which could not be replaced were dropped'.format(
+                unresolved.sum()))
+        return df[~unresolved]
+
+    def remove_emotion(df, threshold):
+        df = remove_subjects_no_value_emotion(df, threshold=threshold)
+        df = df.drop(df[df['no_value_emotion'] == 1].index)
+        return df[columns]
+
+    def to_int(df):
+        for c in columns:
+            df[c] = pd.to_numeric(df[c])
+            df[c] = df[c].astype('int32')
+        return df
+
+    def sort_remove_duplicates(df):
+        df = df.sort_values(by=SORT_COLUMNS, ignore_index=True)
+        return remove_duplicates(df)
+
+    df = timed('replace_no_value_id', replace_id, df)
+    df = timed('drop_unresolved_id', drop_unresolved_id, df)
+    df = timed('remove_subjects_no_value_emotion', remove_emotion, df, threshold)
+    df = timed('to_int', to_int, df)
+    df = timed('remove_duplicates', sort_remove_duplicates, df)
+
+    return df, stages.records
+
+
+@profiler.profile
+def run_pipeline(path, threshold=30, max_workers=None, trace_memory=False):
+
+    """
+    Cleans all video files in parallel, one worker process per video file
+
+    @param path: data_path or data_path_jup
+    @param threshold: threshold passed to remove_subjects_no_value_emotion
+    @param max_workers: number of worker processes; None - number of cores
+    @param trace_memory: if True, record bytes allocated by each stage (slower)
+    @return: a merged cleaned dataframe + a dataframe with per-stage records
+    """
+
+    files = list(data_files(path).values())
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(clean_video, files, [threshold] * len(files), [trace_memory] * len(files)))
+
+    # each file contains a single video => merging sorted videos in video_id order keeps the frame sorted
+    results = sorted([r for r in results if len(r[0])], key=lambda r: r[0]['video_id'].iloc[0]) + \
+        [r for r in results if not len(r[0])]
+    df = pd.concat([r[0] for r in results], ignore_index=True)
+    timings = pd.DataFrame([t for r in results for t in r[1]])
+
+    dropped = timings[timings['stage'] == 'drop_unresolved_id']
+    dropped = int((dropped['rows_in'] - dropped['rows_out']).sum()) if len(dropped) else 0
+    if dropped:
+        profiler.message('{} frames with missing ids which could not be replaced were dropped in total'.format(dropped))
+
+    profiler.message('Stage timings, s:')
+    profiler.message(timings.groupby('stage', sort=False)[['wall_s', 'cpu_s']].agg(['sum', 'max']).round(3), '\n')
+
+    return df, timings
@@ -0,0 +1,194 @@
+"""
+Instrumentation of pipeline stages: wall time, CPU time, peak RSS growth, rows in/out and (optionally) bytes
+allocated, emitted as structured records to a log, a JSON lines file or an in-process summary table.
+
+    profiler = Profiler()
+    df = profiler.profile(remove_duplicates)(df)
+    with profiler.stage('sort', rows_in=len(df)) as record:
+        df = df.sort_values(...)
+        record['rows_out'] = len(df)
+    profiler.summary()
+
+A disabled profiler calls the wrapped functions directly and its stages record nothing. Progress messages of the
+stages (profiler.message) are printed, or passed to the sinks as {'stage', 'message'} records when the profiler is
+enabled with sinks.
+
+The pipeline functions are wrapped with the default profiler below; to record them:
+
+    from _code.profiling import profiler, json_sink
+    profiler.enabled = True
+    profiler.sinks.append(json_sink('stages.jsonl'))
+"""
+
+
+import json
+import time
+import logging
+import functools
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def _max_rss():
+    # peak resident set size of the process, bytes (ru_maxrss is in KB on Linux)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 if resource is not None else 0
+
+
+def _rows(x):
+    # number of rows of a dataframe-like result; first element of a tuple result
+    if isinstance(x, tuple) and x:
+        x = x[0]
+    return len(x) if hasattr(x, '__len__') and not isinstance(x, (str, bytes, dict)) else None
+
+
+def log_sink(logger=None, level=logging.INFO):
+
+    """
+    @param logger: a logger; None - 'pipeline' logger
+    @param level: log level
+    @return: a sink writing records to a log
+    """
+
+    logger = logger or logging.getLogger('pipeline')
+    return lambda record: logger.log(level, json.dumps(record))
+
+
+def json_sink(path):
+
+    """
+    @param path: file path
+    @return: a sink appending records to a JSON lines file
+    """
+
+    def sink(record):
+        with open(path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+    return sink
+
+
+class Profiler:
+
+    """
+    Collects stage records and passes them to sinks. Records are kept in memory for summary().
+    With trace_memory=True tracemalloc is started and 'allocated_bytes' (peak traced memory during a stage) is
+    recorded; nested stages share tracemalloc's peak counter, so only innermost stages are exact.
+    """
+
+    def __init__(self, enabled=True, sinks=(), trace_memory=False):
+        self.enabled = enabled
+        self.sinks = list(sinks)
+        self.trace_memory = trace_memory
+        self.records = []
+        self._stages = []
+
+    @contextmanager
+    def stage(self, name, rows_in=None, **fields):
+
+        """
+        Measures a block of code; the yielded record may be updated (e.g. with 'rows_out')
+
+        @param name: stage name
+        @param rows_in: number of input rows
+        @param fields: additional fields of the record
+        """
+
+        if not self.enabled:
+            yield {}
+            return
+
+        record = dict(stage=name, rows_in=rows_in, rows_out=None, **fields)
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            traced, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+        rss, cpu, wall = _max_rss(), time.process_time(), time.perf_counter()
+        self._stages.append(name)
+
+        try:
+            yield record
+        finally:
+            self._stages.pop()
+            record['wall_s'] = time.perf_counter() - wall
+            record['cpu_s'] = time.process_time() - cpu
+            record['peak_rss_delta_bytes'] = _max_rss() - rss
+            if self.trace_memory:
+                record['allocated_bytes'] = tracemalloc.get_traced_memory()[1] - traced
+            self.emit(record)
+
+    def profile(self, func=None, name=None):
+
+        """
+        Decorator measuring each call of a function; rows in/out are taken from the first argument and the result
+
+        @param func: function
+        @param name: stage name; None - function name
+        """
+
+        if func is None:
+            return functools.partial(self.profile, name=name)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not self.enabled:
+                return func(*args, **kwargs)
+            with self.stage(name or func.__name__, rows_in=_rows(args[0]) if args else None) as record:
+                result = func(*args, **kwargs)
+                record['rows_out'] = _rows(result)
+            return result
+
+        return wrapper
+
+    def emit(self, record):
+
+        """
+        Stores a record and passes it to the sinks
+
+        @param record: dict
+        """
+
+        self.records.append(record)
+        for sink in self.sinks:
+            sink(record)
+
+    def message(self, *values):
+
+        """
+        Progress message of a stage: printed (as print(*values)) or, if the profiler is enabled with sinks, passed
+        to the sinks as a record with the name of the innermost running stage. Messages are not kept in records.
+
+        @param values: objects to be printed
+        """
+
+        if not (self.enabled and self.sinks):
+            print(*values)
+            return
+
+        record = {'stage': self._stages[-1] if self._stages else None, 'message': ' '.join(str(v) for v in values)}
+        for sink in self.sinks:
+            sink(record)
+
+    def summary(self):
+
+        """
+        @return: a dataframe with one row per stage: number of calls and total times, memory and rows
+        """
+
+        df = pd.DataFrame(self.records)
+        if df.empty:
+            return df
+        numeric = [c for c in df.columns if c != 'stage' and pd.api.types.is_numeric_dtype(df[c])]
+
+        return df.groupby('stage', sort=False)[numeric].sum().assign(calls=df.groupby('stage', sort=False).size())
+
+
+# default profiler, disabled until profiler.enabled is set
+profiler = Profiler(enabled=False)
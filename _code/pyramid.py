@@ -0,0 +1,165 @@
+"""
+Multi-resolution time pyramid: sums of metrics and frame counts per video on a base time grid (e.g. 50 ms) and on
+coarser grids built by summing blocks of base bins. Average metric curves for any resolution which is a multiple of the
+base and any time window are read from the closest level without touching the frames.
+
+    pyramid = TimePyramid()
+    pyramid.update(df)
+    df_emotion = pyramid.curve(resolution_ms=1000)
+    plot_emotion_evolution(df_emotion, metrics=['metric_1_avg', 'metric_2_avg', 'metric_3_avg'])
+"""
+
+
+import numpy as np
+import pandas as pd
+
+from _code.functions import pack_emotions
+from _code.emotions import compute_features, README_METRICS
+
+
+LEVELS_MS = (50, 100, 250, 1000, 5000)
+
+
+class TimePyramid:
+
+    """
+    Per video sums of metrics and frame counts on several time grids. The finest level is the base; each level must be
+    a multiple of it. Time bins of a level are numbered from 1 (bin k covers [(k - 1) * level, k * level) ms).
+    """
+
+    def __init__(self, levels_ms=LEVELS_MS, metrics=None):
+        self.levels_ms = sorted(levels_ms)
+        self.base_ms = self.levels_ms[0]
+        if any(level % self.base_ms for level in self.levels_ms):
+            raise ValueError('levels must be multiples of the finest level {} ms'.format(self.base_ms))
+        self.metrics = list(README_METRICS if metrics is None else metrics)
+        self.videos = np.array([], dtype=np.int64)
+        # level -> array (videos, 1 + metrics, bins): frame counts, then metric sums
+        self.levels = {level: np.zeros((0, 1 + len(self.metrics), 0)) for level in self.levels_ms}
+
+    def update(self, df):
+
+        """
+        Adds cleaned frames to the base level in one pass and rebuilds the coarser levels
+
+        @param df: a cleaned dataframe (integer id, time and emotion columns)
+        """
+
+        if not len(df):
+            return
+
+        videos, video = np.unique(df['video_id'].to_numpy(), return_inverse=True)
+        time_bin = df['millisecond_from_start'].to_numpy() // self.base_ms
+        if time_bin.min() < 0:
+            raise ValueError('negative millisecond_from_start')
+        self._grow(videos, int(time_bin.max()) + 1)
+
+        # one flat bincount per column over (video, base bin) keys
+        n = self.levels[self.base_ms].shape[2]
+        key = np.searchsorted(self.videos, videos)[video] * n + time_bin
+        size = len(self.videos) * n
+        features = compute_features(pack_emotions(df), self.metrics)
+        base = self.levels[self.base_ms]
+        base[:, 0] += np.bincount(key, minlength=size).reshape(-1, n)
+        for i, m in enumerate(self.metrics):
+            base[:, i + 1] += np.bincount(key, weights=features[m].to_numpy(), minlength=size).reshape(-1, n)
+
+        self._build()
+
+    def _grow(self, videos, bins):
+        # adds rows for new videos and extends the base grid
+        base = self.levels[self.base_ms]
+        new = np.setdiff1d(videos, self.videos)
+        bins = max(bins, base.shape[2])
+        if len(new) or bins > base.shape[2]:
+            old, self.videos = self.videos, np.union1d(self.videos, new)
+            grown = np.zeros((len(self.videos), base.shape[1], bins))
+            grown[np.searchsorted(self.videos, old), :, :base.shape[2]] = base
+            self.levels[self.base_ms] = grown
+
+    def _build(self):
+        # coarser levels: sums of blocks of base bins
+        base = self.levels[self.base_ms]
+        for level in self.levels_ms[1:]:
+            self.levels[level] = self._coarsen(base, level // self.base_ms)
+
+    @staticmethod
+    def _coarsen(x, factor):
+        # sums blocks of factor bins along the last axis, padding the last block
+        pad = -x.shape[2] % factor
+        x = np.pad(x, ((0, 0), (0, 0), (0, pad)))
+        return x.reshape(x.shape[0], x.shape[1], -1, factor).sum(axis=3)
+
+    def curve(self, resolution_ms=1000, start_ms=None, stop_ms=None, video_ids=None, metrics=None):
+
+        """
+        Returns average metrics per video and time bin
+
+        @param resolution_ms: bin length, a multiple of the base level; read from the coarsest level that divides it
+        @param start_ms: start of the window (rounded down to the bin); None - beginning of the videos
+        @param stop_ms: end of the window (rounded up to the bin); None - end of the videos
+        @param video_ids: list of videos; None - all videos
+        @param metrics: subset of the pyramid's metrics; None - all of them
+        @return: a dataframe with 'video_id', 'time_bin', 'start_ms', metric_i_avg and 'frames' columns; bins without
+                 frames are dropped
+        """
+
+        if resolution_ms % self.base_ms:
+            raise ValueError('resolution must be a multiple of {} ms'.format(self.base_ms))
+        if metrics is None:
+            metrics = self.metrics
+
+        level = max(level for level in self.levels_ms if resolution_ms % level == 0)
+        factor = resolution_ms // level
+        x = self.levels[level]
+
+        rows = np.arange(len(self.videos)) if video_ids is None else np.searchsorted(self.videos, video_ids)
+        if video_ids is not None and not np.array_equal(self.videos[np.minimum(rows, len(self.videos) - 1)],
+                                                        video_ids):
+            raise KeyError('unknown video ids')
+
+        # window in bins of the requested resolution, then in bins of the level
+        first = 0 if start_ms is None else max(start_ms // resolution_ms, 0)
+        last = -(-x.shape[2] // factor) if stop_ms is None else -(-stop_ms // resolution_ms)
+        x = x[rows, :, first * factor:last * factor]
+        if factor > 1:
+            x = self._coarsen(x, factor)
+
+        frames = x[:, 0]
+        video, k = np.nonzero(frames)
+        df = pd.DataFrame({'video_id': self.videos[rows][video], 'time_bin': first + k + 1,
+                           'start_ms': (first + k) * resolution_ms})
+        for m in metrics:
+            df[m + '_avg'] = x[video, self.metrics.index(m) + 1, k] / frames[video, k]
+        df['frames'] = frames[video, k].astype(np.int64)
+
+        return df
+
+    def save(self, path):
+
+        """
+        Saves the base level to a compressed .npz file
+
+        @param path: file path
+        """
+
+        np.savez_compressed(path, levels_ms=np.array(self.levels_ms), metrics=np.array(self.metrics),
+                            videos=self.videos, base=self.levels[self.base_ms])
+
+    @classmethod
+    def load(cls, path):
+
+        """
+        Loads a pyramid saved by save
+
+        @param path: file path
+        @return: TimePyramid
+        """
+
+        with np.load(path) as arrays:
+            pyramid = cls(levels_ms=[int(x) for x in arrays['levels_ms']], metrics=list(arrays['metrics']))
+            pyramid.videos = arrays['videos']
+            pyramid.levels[pyramid.base_ms] = arrays['base']
+        pyramid._build()
+
+        return pyramid
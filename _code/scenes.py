@@ -0,0 +1,120 @@
+"""
+Scene attribution: frames are assigned to scenes of their video given a table of scene boundaries, and metrics are
+aggregated per scene, per subject and scene and per video and scene. All videos are joined at once: the keys
+video * span + millisecond of the scene starts are sorted and frames are looked up with one searchsorted.
+
+    scenes = pd.DataFrame({'video_id': [1, 1, 2], 'scene': ['intro', 'product', 'intro'],
+                           'start_ms': [0, 5000, 0], 'end_ms': [5000, 30000, 8000]})
+    result = scene_metrics(df, scenes)
+    result.videos
+"""
+
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from _code.functions import emotion_columns
+from _code.emotions import aggregate, README_METRICS
+
+# scenes: name_avg and 'frames' per scene label over all videos, subjects: per ('video_id', 'subject_id', 'scene'),
+# videos: per ('video_id', 'scene') with scene boundaries and number of subjects
+SceneMetrics = namedtuple('SceneMetrics', ['scenes', 'subjects', 'videos'])
+
+
+def normalize_scenes(scenes):
+
+    """
+    Sorts scene boundaries and checks them
+
+    @param scenes: a dataframe with 'video_id', 'scene' (label), 'start_ms' and 'end_ms' (exclusive) columns;
+                   scenes of a video must not overlap, gaps are allowed
+    @return: the scenes sorted by ('video_id', 'start_ms') with a new index
+    """
+
+    missing = {'video_id', 'scene', 'start_ms', 'end_ms'} - set(scenes.columns)
+    if missing:
+        raise ValueError('scene table has no columns {}'.format(sorted(missing)))
+
+    scenes = scenes.sort_values(['video_id', 'start_ms'], ignore_index=True)
+    video = scenes['video_id'].to_numpy()
+    start, end = scenes['start_ms'].to_numpy(), scenes['end_ms'].to_numpy()
+    if (end <= start).any():
+        raise ValueError('scenes must end after they start')
+    if ((video[1:] == video[:-1]) & (start[1:] < end[:-1])).any():
+        raise ValueError('scenes of a video overlap')
+
+    return scenes
+
+
+def assign_scenes(df, scenes):
+
+    """
+    Finds the scene of each frame
+
+    @param df: frames with 'video_id' and 'millisecond_from_start' columns
+    @param scenes: output of normalize_scenes
+    @return: int64 array of rows of scenes; -1 for frames outside of the scenes of their video
+    """
+
+    videos, scene_video = np.unique(scenes['video_id'].to_numpy(), return_inverse=True)
+    start = scenes['start_ms'].to_numpy().astype(np.int64)
+    end = scenes['end_ms'].to_numpy().astype(np.int64)
+    ms = df['millisecond_from_start'].to_numpy().astype(np.int64)
+    if not len(scenes) or not len(df):
+        return np.full(len(df), -1, dtype=np.int64)
+
+    # one sorted key per video and time: video * span + ms
+    low = min(start.min(), ms.min())
+    span = max(end.max(), ms.max()) - low + 1
+    frame_video = np.searchsorted(videos, df['video_id'].to_numpy())
+    known = frame_video < len(videos)
+    known[known] = videos[frame_video[known]] == df['video_id'].to_numpy()[known]
+
+    keys = scene_video * span + (start - low)
+    row = np.searchsorted(keys, np.where(known, frame_video, 0) * span + (ms - low), side='right') - 1
+    row = np.maximum(row, 0)
+    inside = known & (scene_video[row] == frame_video) & (ms >= start[row]) & (ms < end[row])
+
+    return np.where(inside, row, -1)
+
+
+def scene_metrics(df, scenes, metrics=None):
+
+    """
+    Aggregates metrics per scene in one grouped pass per table (see emotions.aggregate); frames outside of scenes are
+    ignored
+
+    @param df: cleaned frames
+    @param scenes: a dataframe with 'video_id', 'scene', 'start_ms' and 'end_ms' columns (see normalize_scenes)
+    @param metrics: registered features (see emotions.register_feature); None - README metrics
+    @return: SceneMetrics of dataframes with metric_i_avg and 'frames' columns
+    """
+
+    if metrics is None:
+        metrics = README_METRICS
+
+    scenes = normalize_scenes(scenes)
+    row = assign_scenes(df, scenes)
+    inside = row >= 0
+    x = df.loc[inside, ['video_id', 'subject_id'] + emotion_columns(df)].assign(scene_row=row[inside])
+
+    subjects = aggregate(x, ['video_id', 'subject_id', 'scene_row'], metrics).reset_index()
+    videos = aggregate(x, ['scene_row'], metrics)
+    videos['subjects'] = subjects.groupby('scene_row').size()
+
+    # labels and boundaries of scene rows
+    labels = scenes['scene'].to_numpy()
+    subjects['scene'] = labels[subjects.pop('scene_row').to_numpy()]
+    subjects = subjects.set_index(['video_id', 'subject_id', 'scene'])
+    info = scenes.iloc[videos.index.to_numpy()]
+    videos = videos.reset_index(drop=True)
+    videos.index = pd.MultiIndex.from_arrays([info['video_id'].to_numpy(), info['scene'].to_numpy()],
+                                             names=['video_id', 'scene'])
+    videos.insert(0, 'start_ms', info['start_ms'].to_numpy())
+    videos.insert(1, 'end_ms', info['end_ms'].to_numpy())
+
+    by_label = aggregate(x.assign(scene=labels[row[inside]]), ['scene'], metrics)
+
+    return SceneMetrics(by_label, subjects, videos)
@@ -0,0 +1,238 @@
+"""
+Scoring service: watches a drop directory for new dsc_homework_video_X.csv files, cleans and scores each file in a
+process pool and publishes a per-video summary as JSON to an output directory and, optionally, over HTTP.
+
+For each metric the summary holds two different averages: 'total' - metric_i_total of the README (the mean over 1 s
+time bins of the frame averages of each bin), without an interval, and 'subject_mean' - the mean over subjects of
+their average metric, with the bootstrap confidence interval 'subject_mean_ci_low', 'subject_mean_ci_high'. The
+interval is not an interval of 'total'.
+
+New files wait in a bounded queue: when all workers are busy and the queue is full, the directory is not polled until
+a slot frees up. A file is picked up once its size and modification time are unchanged between two polls; a file which
+is replaced later is scored again.
+
+Usage (from the repository root):
+    python -m _code.service drop/ scores/ --workers 2 --port 8080
+    curl localhost:8080/videos/1
+"""
+
+
+import os
+import sys
+import json
+import glob
+import asyncio
+import logging
+import argparse
+import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+from _code.pipeline import clean_video
+from _code.aggregates import AggregateStore
+from _code.emotions import README_METRICS
+from _code.inference import subject_table, bootstrap
+
+
+PATTERN = 'dsc_homework_video_*.csv'
+
+logger = logging.getLogger('service')
+
+
+def score_video(file, threshold=30, n_resamples=10000, alpha=0.05, seed=0):
+
+    """
+    Cleans a video file and summarises its metrics (runs in a worker process)
+
+    @param file: path to a video file
+    @param threshold: see remove_subjects_no_value_emotion
+    @param n_resamples: number of bootstrap resamples
+    @param alpha: 1 - confidence level
+    @param seed: random seed of the bootstrap
+    @return: a list of summaries, one per video id in the file; the confidence intervals are intervals of
+             'subject_mean', not of 'total' (see the module docstring)
+    """
+
+    df, _ = clean_video(file, threshold)
+    if not len(df):
+        return []
+
+    store = AggregateStore()
+    store.update(df)
+    totals = store.video_means()
+    subjects = subject_table(df)
+    intervals = {m: bootstrap(subjects, m, n_resamples=n_resamples, alpha=alpha, seed=seed) for m in README_METRICS}
+
+    summaries = []
+    for v in totals.index:
+        metrics = {}
+        for m in README_METRICS:
+            ci = intervals[m].loc[v]
+            metrics[m] = {'total': float(totals.loc[v, m + '_total']), 'subject_mean': float(ci['mean']),
+                          'subject_mean_ci_low': float(ci['ci_low']), 'subject_mean_ci_high': float(ci['ci_high'])}
+        summaries.append({'video_id': int(v), 'file': os.path.basename(file),
+                          'subjects': int(intervals[README_METRICS[0]].loc[v, 'subjects']),
+                          'frames': int((df['video_id'] == v).sum()), 'confidence': 1 - alpha,
+                          'metrics': metrics, 'scored_at': datetime.datetime.now().isoformat(timespec='seconds')})
+
+    return summaries
+
+
+def write_summary(summary, directory):
+
+    """
+    Writes a summary to directory/video_<video_id>.json, replacing the previous one atomically
+
+    @param summary: a summary returned by score_video
+    @param directory: output directory
+    """
+
+    path = os.path.join(directory, 'video_{}.json'.format(summary['video_id']))
+    with open(path + '.tmp', 'w') as f:
+        json.dump(summary, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+class Service:
+
+    """
+    Drop directory watcher, bounded queue of files and a pool of scoring workers.
+    Latest summaries are kept in memory (summaries, by video id) for the HTTP endpoint.
+    """
+
+    def __init__(self, drop_dir, output_dir, workers=2, queue_size=4, poll_s=1.0, threshold=30, n_resamples=10000):
+        self.drop_dir = drop_dir
+        self.output_dir = output_dir
+        self.workers = workers
+        self.queue_size = queue_size
+        self.poll_s = poll_s
+        self.threshold = threshold
+        self.n_resamples = n_resamples
+        self.summaries = {}
+        # path -> (size, mtime) of files already queued; path -> state seen at the previous poll
+        self.queued = {}
+        self.pending = {}
+
+    def poll(self):
+
+        """
+        @return: list of files which are new or changed and whose state did not change since the previous poll
+        """
+
+        ready = []
+        current = {}
+        for file in sorted(glob.glob(os.path.join(self.drop_dir, PATTERN))):
+            try:
+                stat = os.stat(file)
+            except OSError:
+                continue
+            state = (stat.st_size, stat.st_mtime)
+            current[file] = state
+            if self.queued.get(file) != state and self.pending.get(file) == state:
+                ready.append(file)
+        self.pending = current
+
+        return ready
+
+    async def watch(self, queue, once=False):
+        # puts ready files to the queue; blocks while the queue is full
+        while True:
+            for file in self.poll():
+                self.queued[file] = self.pending[file]
+                await queue.put(file)
+            if once and all(self.queued.get(f) == s for f, s in self.pending.items()):
+                return
+            await asyncio.sleep(self.poll_s)
+
+    async def work(self, queue, executor):
+        # scores queued files one at a time
+        loop = asyncio.get_running_loop()
+        while True:
+            file = await queue.get()
+            try:
+                summaries = await loop.run_in_executor(executor, score_video, file, self.threshold, self.n_resamples)
+                for summary in summaries:
+                    write_summary(summary, self.output_dir)
+                    self.summaries[summary['video_id']] = summary
+                logger.info('scored %s: %s', file, [s['video_id'] for s in summaries])
+            except Exception:
+                logger.exception('failed to score %s', file)
+            finally:
+                queue.task_done()
+
+    async def handle(self, reader, writer):
+        # GET / - all summaries, GET /videos/<video_id> - one summary
+        try:
+            request = (await reader.readline()).decode('latin-1').split()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            path = request[1].rstrip('/') if len(request) > 1 else ''
+            status, body = '404 Not Found', {'error': 'not found'}
+            if request[:1] != ['GET']:
+                status, body = '405 Method Not Allowed', {'error': 'method not allowed'}
+            elif path == '':
+                status, body = '200 OK', list(self.summaries.values())
+            elif path.startswith('/videos/') and path[len('/videos/'):].lstrip('-').isdigit():
+                summary = self.summaries.get(int(path[len('/videos/'):]))
+                if summary is not None:
+                    status, body = '200 OK', summary
+            data = json.dumps(body).encode()
+            writer.write('HTTP/1.1 {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n'
+                         'Connection: close\r\n\r\n'.format(status, len(data)).encode() + data)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def run(self, host='127.0.0.1', port=None, once=False):
+
+        """
+        Runs the service
+
+        @param host: HTTP host
+        @param port: HTTP port; None - no HTTP endpoint
+        @param once: if True, score the files present in the drop directory and return
+        """
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        server = await asyncio.start_server(self.handle, host, port) if port is not None else None
+
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            workers = [asyncio.ensure_future(self.work(queue, executor)) for _ in range(self.workers)]
+            try:
+                await self.watch(queue, once)
+                await queue.join()
+            finally:
+                for w in workers:
+                    w.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+                if server is not None:
+                    server.close()
+                    await server.wait_closed()
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('drop_dir')
+    parser.add_argument('output_dir')
+    parser.add_argument('--workers', type=int, default=2, help='number of videos scored concurrently')
+    parser.add_argument('--queue-size', type=int, default=4, help='number of files waiting for a worker')
+    parser.add_argument('--poll', type=float, default=1.0, help='polling interval, s')
+    parser.add_argument('--threshold', type=float, default=30)
+    parser.add_argument('--resamples', type=int, default=10000)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=None)
+    parser.add_argument('--once', action='store_true', help='score the present files and exit')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    service = Service(args.drop_dir, args.output_dir, workers=args.workers, queue_size=args.queue_size,
+                      poll_s=args.poll, threshold=args.threshold, n_resamples=args.resamples)
+    try:
+        asyncio.run(service.run(args.host, args.port, args.once))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    sys.exit(main())
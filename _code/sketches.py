@@ -0,0 +1,384 @@
+"""
+Mergeable distribution summaries: quantile sketches with relative accuracy (log-spaced buckets, as DDSketch) and
+fixed-bin histograms. Memory does not depend on the number of values; sketches built on separate chunks, videos or
+worker processes are merged exactly (bucket counts are added).
+
+DistributionReport keeps per-video sketches of time between frames ('time_diff'), per-subject framerate and number of
+frames, fed by cleaned chunks of whole subjects:
+
+    report = DistributionReport()
+    stream(data_path, consumers=[report.update])
+    report.describe()
+    report.save('distributions.json')
+"""
+
+
+import json
+
+import numpy as np
+import pandas as pd
+
+from _code.subjects import SubjectIndex
+
+
+def _add(counts, offset, keys, weights=None):
+    # adds bucket keys to a dense count array starting at bucket offset, growing it as needed
+    if not len(keys):
+        return counts, offset
+    low, high = int(keys.min()), int(keys.max())
+    if not len(counts):
+        counts, offset = np.zeros(0, dtype=np.int64), low
+    new_offset = min(offset, low)
+    size = max(offset + len(counts), high + 1) - new_offset
+    if new_offset != offset or size != len(counts):
+        grown = np.zeros(size, dtype=np.int64)
+        grown[offset - new_offset:offset - new_offset + len(counts)] = counts
+        counts, offset = grown, new_offset
+    counts += np.bincount(keys - offset, weights=weights, minlength=len(counts)).astype(np.int64)
+    return counts, offset
+
+
+class QuantileSketch:
+
+    """
+    Quantile sketch with relative accuracy: a value x > 0 falls into bucket ceil(log(x) / log(gamma)),
+    gamma = (1 + relative_accuracy) / (1 - relative_accuracy), and every quantile is returned within relative_accuracy
+    of a value of the data. Negative values are kept in mirrored buckets, zeros are counted separately.
+    Count, sum, sum of squares, min and max are exact.
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.positive, self.positive_offset = np.zeros(0, dtype=np.int64), 0
+        self.negative, self.negative_offset = np.zeros(0, dtype=np.int64), 0
+        self.zeros = 0
+        self.count = 0
+        self.sum = 0.
+        self.sum_sq = 0.
+        self.min = np.inf
+        self.max = -np.inf
+
+    def _keys(self, x):
+        return np.ceil(np.log(x) / np.log(self.gamma)).astype(np.int64)
+
+    def _values(self, keys):
+        # bucket representative with relative error at most relative_accuracy
+        return 2 * self.gamma ** keys / (self.gamma + 1)
+
+    def update(self, values):
+
+        """
+        Adds values; nan values are skipped
+
+        @param values: numeric array
+        """
+
+        x = np.asarray(values, dtype=np.float64).ravel()
+        x = x[~np.isnan(x)]
+        if not len(x):
+            return
+
+        tiny = np.finfo(np.float64).tiny
+        self.positive, self.positive_offset = _add(self.positive, self.positive_offset, self._keys(x[x > tiny]))
+        self.negative, self.negative_offset = _add(self.negative, self.negative_offset, self._keys(-x[x < -tiny]))
+        self.zeros += int((np.abs(x) <= tiny).sum())
+        self.count += len(x)
+        self.sum += float(x.sum())
+        self.sum_sq += float((x ** 2).sum())
+        self.min = min(self.min, float(x.min()))
+        self.max = max(self.max, float(x.max()))
+
+    def merge(self, other):
+
+        """
+        Adds the values of another sketch with the same relative accuracy
+
+        @param other: QuantileSketch
+        @return: self
+        """
+
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError('sketches with different relative accuracy cannot be merged')
+
+        for name in ['positive', 'negative']:
+            counts, offset = getattr(other, name), getattr(other, name + '_offset')
+            if len(counts):
+                counts, offset = _add(getattr(self, name), getattr(self, name + '_offset'),
+                                      offset + np.flatnonzero(counts), counts[counts > 0])
+                setattr(self, name, counts)
+                setattr(self, name + '_offset', offset)
+        self.zeros += other.zeros
+        self.count += other.count
+        self.sum += other.sum
+        self.sum_sq += other.sum_sq
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+        return self
+
+    def quantile(self, q):
+
+        """
+        @param q: quantile or array of quantiles in [0, 1]
+        @return: estimated quantiles (as numpy.quantile); nan if the sketch is empty
+        """
+
+        q = np.asarray(q, dtype=np.float64)
+        if not self.count:
+            return np.full(q.shape, np.nan) if q.ndim else np.nan
+
+        # buckets in increasing order of values: negative (reversed), zero, positive
+        negative_keys = self.negative_offset + np.arange(len(self.negative))
+        positive_keys = self.positive_offset + np.arange(len(self.positive))
+        values = np.concatenate([-self._values(negative_keys[::-1]), [0.], self._values(positive_keys)])
+        counts = np.concatenate([self.negative[::-1], [self.zeros], self.positive])
+
+        i = np.searchsorted(np.cumsum(counts), q * (self.count - 1), side='right')
+
+        return np.clip(values[np.minimum(i, len(values) - 1)], self.min, self.max)
+
+    def describe(self):
+
+        """
+        @return: a series as pandas.Series.describe: count, mean, std, min, quartiles, max
+        """
+
+        mean = self.sum / self.count if self.count else np.nan
+        var = (self.sum_sq - self.count * mean ** 2) / (self.count - 1) if self.count > 1 else np.nan
+        quartiles = self.quantile([0.25, 0.5, 0.75])
+
+        return pd.Series([self.count, mean, np.sqrt(max(var, 0)), self.min if self.count else np.nan, *quartiles,
+                          self.max if self.count else np.nan],
+                         index=['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max'])
+
+    def to_dict(self):
+        return {'relative_accuracy': self.relative_accuracy, 'positive': self.positive.tolist(),
+                'positive_offset': self.positive_offset, 'negative': self.negative.tolist(),
+                'negative_offset': self.negative_offset, 'zeros': self.zeros, 'count': self.count, 'sum': self.sum,
+                'sum_sq': self.sum_sq, 'min': self.min if self.count else None, 'max': self.max if self.count else None}
+
+    @classmethod
+    def from_dict(cls, d):
+        sketch = cls(d['relative_accuracy'])
+        sketch.positive, sketch.positive_offset = np.array(d['positive'], dtype=np.int64), d['positive_offset']
+        sketch.negative, sketch.negative_offset = np.array(d['negative'], dtype=np.int64), d['negative_offset']
+        sketch.zeros, sketch.count, sketch.sum, sketch.sum_sq = d['zeros'], d['count'], d['sum'], d['sum_sq']
+        sketch.min = d['min'] if d['min'] is not None else np.inf
+        sketch.max = d['max'] if d['max'] is not None else -np.inf
+        return sketch
+
+
+class Histogram:
+
+    """
+    Histogram with fixed bin edges (as numpy.histogram, the last bin includes its right edge) and counts of values
+    below and above the edges
+    """
+
+    def __init__(self, edges):
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.counts = np.zeros(len(self.edges) - 1, dtype=np.int64)
+        self.below = 0
+        self.above = 0
+
+    def update(self, values):
+
+        """
+        Adds values; nan values are skipped
+
+        @param values: numeric array
+        """
+
+        x = np.asarray(values, dtype=np.float64).ravel()
+        x = x[~np.isnan(x)]
+        i = np.searchsorted(self.edges, x, side='right') - 1
+        i[x == self.edges[-1]] = len(self.counts) - 1
+        inside = (i >= 0) & (i < len(self.counts))
+        self.counts += np.bincount(i[inside], minlength=len(self.counts))
+        self.below += int((i < 0).sum())
+        self.above += int((i >= len(self.counts)).sum())
+
+    def merge(self, other):
+
+        """
+        Adds the counts of another histogram with the same edges
+
+        @param other: Histogram
+        @return: self
+        """
+
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError('histograms with different edges cannot be merged')
+        self.counts += other.counts
+        self.below += other.below
+        self.above += other.above
+
+        return self
+
+    def to_dict(self):
+        return {'edges': self.edges.tolist(), 'counts': self.counts.tolist(), 'below': self.below, 'above': self.above}
+
+    @classmethod
+    def from_dict(cls, d):
+        histogram = cls(d['edges'])
+        histogram.counts = np.array(d['counts'], dtype=np.int64)
+        histogram.below, histogram.above = d['below'], d['above']
+        return histogram
+
+
+# summarised quantities: time between consecutive frames of a subject (ms), framerate of a subject (frames per second),
+# number of frames of a subject
+QUANTITIES = ['time_diff', 'framerate', 'no_of_frames']
+
+# histogram edges of analysis_draft.py: time_diff < 85 ms in 85 bins
+HISTOGRAMS = {'time_diff': np.linspace(0, 85, 86)}
+
+
+class DistributionReport:
+
+    """
+    Per video sketches (and fixed-bin histograms) of QUANTITIES; summaries of all videos are merged on demand
+    """
+
+    def __init__(self, relative_accuracy=0.01, histograms=None):
+        self.relative_accuracy = relative_accuracy
+        self.histogram_edges = dict(HISTOGRAMS if histograms is None else histograms)
+        # video_id -> {quantity: QuantileSketch}, video_id -> {quantity: Histogram}
+        self.sketches = {}
+        self.histograms = {}
+
+    def _video(self, v):
+        if v not in self.sketches:
+            self.sketches[v] = dict((q, QuantileSketch(self.relative_accuracy)) for q in QUANTITIES)
+            self.histograms[v] = dict((q, Histogram(e)) for q, e in self.histogram_edges.items())
+        return self.sketches[v], self.histograms[v]
+
+    def update(self, df):
+
+        """
+        Adds cleaned frames of whole subjects (e.g. a chunk passed to the consumers of streaming.stream)
+
+        @param df: cleaned frames sorted by ['video_id', 'subject_id', 'frame_no', 'millisecond_from_start']
+        """
+
+        if not len(df):
+            return
+
+        subjects = SubjectIndex(df)
+        ms = df['millisecond_from_start'].to_numpy()
+        span = (subjects.last(ms) - subjects.first(ms)).astype(np.float64)
+        values = {'time_diff': subjects.diff(ms),
+                  'framerate': np.where(span > 0, (subjects.sizes - 1) / np.where(span > 0, span, 1) * 1000, np.nan),
+                  'no_of_frames': subjects.sizes}
+
+        for j, v in enumerate(subjects.videos):
+            subject_range = slice(subjects.video_offsets[j], subjects.video_offsets[j + 1])
+            rows = slice(subjects.offsets[subject_range.start], subjects.offsets[subject_range.stop])
+            sketches, histograms = self._video(v.item())
+            for q in QUANTITIES:
+                x = values[q][rows] if q == 'time_diff' else values[q][subject_range]
+                sketches[q].update(x)
+                if q in histograms:
+                    histograms[q].update(x)
+
+    def merge(self, other):
+
+        """
+        Adds another report (e.g. built by a worker process on other videos or chunks)
+
+        @param other: DistributionReport
+        @return: self
+        """
+
+        for v in other.sketches:
+            sketches, histograms = self._video(v)
+            for q in QUANTITIES:
+                sketches[q].merge(other.sketches[v][q])
+            for q in histograms:
+                histograms[q].merge(other.histograms[v][q])
+
+        return self
+
+    def total(self, quantity):
+
+        """
+        @param quantity: one of QUANTITIES
+        @return: a sketch of all videos
+        """
+
+        sketch = QuantileSketch(self.relative_accuracy)
+        for v in self.sketches:
+            sketch.merge(self.sketches[v][quantity])
+
+        return sketch
+
+    def histogram(self, quantity, video_id=None):
+
+        """
+        @param quantity: a quantity with a fixed-bin histogram
+        @param video_id: video id; None - all videos
+        @return: counts + bin edges (as numpy.histogram)
+        """
+
+        histogram = Histogram(self.histogram_edges[quantity])
+        for v in ([video_id] if video_id is not None else self.histograms):
+            histogram.merge(self.histograms[v][quantity])
+
+        return histogram.counts, histogram.edges
+
+    def describe(self):
+
+        """
+        @return: a dataframe indexed by (video_id, quantity) with descriptive statistics; video_id 'all' - all videos
+        """
+
+        rows = {}
+        for v in sorted(self.sketches):
+            for q in QUANTITIES:
+                rows[(v, q)] = self.sketches[v][q].describe()
+        for q in QUANTITIES:
+            rows[('all', q)] = self.total(q).describe()
+
+        df = pd.DataFrame(rows).T
+        df.index.names = ['video_id', 'quantity']
+
+        return df
+
+    def save(self, path):
+
+        """
+        Saves the report to a JSON file
+
+        @param path: file path
+        """
+
+        with open(path, 'w') as f:
+            json.dump({'relative_accuracy': self.relative_accuracy,
+                       'histograms': dict((q, e.tolist()) for q, e in self.histogram_edges.items()),
+                       'videos': [{'video_id': v,
+                                   'sketches': dict((q, s.to_dict()) for q, s in self.sketches[v].items()),
+                                   'histograms': dict((q, h.to_dict()) for q, h in self.histograms[v].items())}
+                                  for v in self.sketches]}, f)
+
+    @classmethod
+    def load(cls, path):
+
+        """
+        Loads a report saved by save
+
+        @param path: file path
+        @return: DistributionReport
+        """
+
+        with open(path) as f:
+            d = json.load(f)
+
+        report = cls(d['relative_accuracy'], dict((q, np.array(e)) for q, e in d['histograms'].items()))
+        for video in d['videos']:
+            report.sketches[video['video_id']] = dict((q, QuantileSketch.from_dict(s))
+                                                      for q, s in video['sketches'].items())
+            report.histograms[video['video_id']] = dict((q, Histogram.from_dict(h))
+                                                        for q, h in video['histograms'].items())
+
+        return report
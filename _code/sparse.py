@@ -0,0 +1,254 @@
+"""
+Sparse emotions: most frames carry no emotion, so for each subject only runs of frames with the same non-zero packed
+emotions (see pack_emotions) are kept as intervals [start_ms, end_ms). Frames without emotions are implied by the
+subject's time span. Metrics are computed on the runs, so memory and time scale with the number of emotion changes
+rather than the number of frames.
+
+    sparse = encode(df)
+    subject_means(sparse)
+    bin_means(sparse, bin_ms=1000)
+    time_to_first(sparse, 'any_positive')
+    longest_run(sparse, 'any_negative')
+"""
+
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from _code.functions import pack_emotions
+from _code.emotions import FEATURES, README_METRICS
+from _code.features import frame_duration
+
+
+# subjects: one row per subject ('video_id', 'subject_id', 'frames', 'start_ms', 'end_ms', 'duration'),
+# runs: one row per run of equal non-zero packed emotions ('subject' - row of subjects, 'code' - packed emotions,
+# 'first' - number of the first frame within the subject, starting from 0, 'frames', 'start_ms', 'end_ms', 'duration');
+# 'duration' is the sum of frame durations (see features.frame_duration), which is less than end_ms - start_ms when
+# gaps are capped
+Sparse = namedtuple('Sparse', ['subjects', 'runs'])
+
+
+def encode(df, max_gap_ms=None):
+
+    """
+    Run-length encodes the emotions of cleaned frames. A frame lasts until the next frame of the subject
+    (see features.frame_duration).
+
+    @param df: cleaned frames sorted by ['video_id', 'subject_id', 'frame_no', 'millisecond_from_start']
+    @param max_gap_ms: see features.frame_duration; capped durations are summed into 'duration', time spans
+                       (start_ms, end_ms) are not capped within runs
+    @return: Sparse
+    """
+
+    video = df['video_id'].to_numpy()
+    subject = df['subject_id'].to_numpy()
+    ms = df['millisecond_from_start'].to_numpy().astype(np.int64)
+    duration = frame_duration(df, max_gap_ms)
+    end = ms + np.round(duration).astype(np.int64)
+    # sums of durations over rows a:b are cumulative[b] - cumulative[a]
+    cumulative = np.concatenate([[0], np.cumsum(duration)])
+    packed = pack_emotions(df)
+
+    new_subject = np.ones(len(df), dtype=bool)
+    new_subject[1:] = (subject[1:] != subject[:-1]) | (video[1:] != video[:-1])
+    new_run = new_subject.copy()
+    new_run[1:] |= packed[1:] != packed[:-1]
+
+    subject_starts = np.flatnonzero(new_subject)
+    subject_stops = np.append(subject_starts, len(df))[1:]
+    subjects = pd.DataFrame({'video_id': video[subject_starts], 'subject_id': subject[subject_starts],
+                             'frames': (subject_stops - subject_starts).astype(np.int32),
+                             'start_ms': ms[subject_starts].astype(np.int32),
+                             'end_ms': end[subject_stops - 1].astype(np.int32),
+                             'duration': cumulative[subject_stops] - cumulative[subject_starts]})
+
+    starts = np.flatnonzero(new_run)
+    stops = np.append(starts, len(df))[1:]
+    keep = packed[starts] != 0
+    starts, stops = starts[keep], stops[keep]
+    row = np.cumsum(new_subject)[starts] - 1
+    runs = pd.DataFrame({'subject': row.astype(np.int32), 'code': packed[starts],
+                         'first': (starts - subject_starts[row]).astype(np.int32),
+                         'frames': (stops - starts).astype(np.int32),
+                         'start_ms': ms[starts].astype(np.int32), 'end_ms': end[stops - 1].astype(np.int32),
+                         'duration': cumulative[stops] - cumulative[starts]})
+
+    return Sparse(subjects, runs)
+
+
+def concat(parts):
+
+    """
+    Concatenates encoded batches of whole subjects (e.g. cleaned chunks of streaming.stream)
+
+    @param parts: list of Sparse
+    @return: Sparse
+    """
+
+    offsets = np.cumsum([0] + [len(p.subjects) for p in parts[:-1]])
+    runs = [p.runs.assign(subject=p.runs['subject'] + np.int32(k)) for p, k in zip(parts, offsets)]
+
+    return Sparse(pd.concat([p.subjects for p in parts], ignore_index=True), pd.concat(runs, ignore_index=True))
+
+
+def _index(sparse):
+    # (video_id, subject_id) index of per-subject results
+    return pd.MultiIndex.from_frame(sparse.subjects[['video_id', 'subject_id']])
+
+
+def subject_means(sparse, names=None, weight='frames'):
+
+    """
+    Averages per-frame features over the frames of each subject. Runs without emotions are not stored, so each run
+    contributes the difference between its value and the value of a frame without emotions.
+
+    @param sparse: Sparse
+    @param names: registered features (see emotions.register_feature); None - README metrics
+    @param weight: 'frames' - each frame counts once (as the dense mean), 'duration' - each frame is weighted by its
+                   duration (as features.weighted_metrics)
+    @return: a dataframe indexed by ('video_id', 'subject_id') with name_avg columns
+    """
+
+    if names is None:
+        names = README_METRICS
+
+    subjects, runs = sparse.subjects, sparse.runs
+    if weight == 'frames':
+        total, w = subjects['frames'].to_numpy(), runs['frames'].to_numpy()
+    else:
+        total, w = subjects['duration'].to_numpy(), runs['duration'].to_numpy()
+    total = total.astype(np.float64)
+    row = runs['subject'].to_numpy()
+    code = runs['code'].to_numpy()
+
+    df = pd.DataFrame(index=_index(sparse))
+    for name in names:
+        values = FEATURES[name].astype(np.float64)
+        sums = np.bincount(row, weights=(values[code] - values[0]) * w, minlength=len(subjects))
+        df[name + '_avg'] = values[0] + sums / np.where(total > 0, total, np.nan)
+
+    return df
+
+
+def _overlap(start, end, weight, edges):
+    # sum of weight * length of [start, end) within each [edges[k], edges[k + 1]):
+    # F(t) = sum(weight * clip(t - start, 0, end - start)) = sum_{start < t}(weight * (t - start)) -
+    #        sum_{end < t}(weight * (t - end)) is evaluated at the edges with cumulative sums
+    def part(x):
+        order = np.argsort(x, kind='stable')
+        x, w = x[order].astype(np.float64), weight[order]
+        k = np.searchsorted(x, edges)
+        cw = np.concatenate([[0], np.cumsum(w)])
+        cwx = np.concatenate([[0], np.cumsum(w * x)])
+        return cw[k] * edges - cwx[k]
+
+    return np.diff(part(start) - part(end))
+
+
+def bin_means(sparse, bin_ms=1000, names=None):
+
+    """
+    Averages per-frame features over fixed time bins of each video, weighting each run by its overlap with the bin
+    (time-weighted; with time bins numbered from 1 as in aggregates.AggregateStore)
+
+    @param sparse: Sparse
+    @param bin_ms: length of a time bin in ms
+    @param names: registered features (see emotions.register_feature); None - README metrics
+    @return: a dataframe indexed by ('video_id', 'time_bin') with name_avg columns and covered time 'duration'
+    """
+
+    if names is None:
+        names = README_METRICS
+
+    subjects, runs = sparse.subjects, sparse.runs
+    run_video = subjects['video_id'].to_numpy()[runs['subject'].to_numpy()]
+    code = runs['code'].to_numpy()
+
+    results = []
+    for v in pd.unique(subjects['video_id']):
+        s = subjects[subjects['video_id'].to_numpy() == v]
+        r = runs[run_video == v]
+        start, end = s['start_ms'].to_numpy(), s['end_ms'].to_numpy()
+        edges = np.arange(start.min() // bin_ms, end.max() // bin_ms + 2) * bin_ms
+        duration = _overlap(start, end, np.ones(len(s)), edges)
+
+        x = pd.DataFrame({'video_id': v, 'time_bin': edges[:-1] // bin_ms + 1, 'duration': duration})
+        for name in names:
+            values = FEATURES[name].astype(np.float64)
+            sums = _overlap(r['start_ms'].to_numpy(), r['end_ms'].to_numpy(),
+                            values[code[run_video == v]] - values[0], edges)
+            x[name + '_avg'] = values[0] + sums / np.where(duration > 0, duration, np.nan)
+        results.append(x[x['duration'] > 0])
+
+    if not results:
+        return pd.DataFrame(columns=[name + '_avg' for name in names] + ['duration'],
+                            index=pd.MultiIndex.from_arrays([[], []], names=['video_id', 'time_bin']))
+
+    return pd.concat(results).set_index(['video_id', 'time_bin'])[[name + '_avg' for name in names] + ['duration']]
+
+
+def feature_runs(sparse, name):
+
+    """
+    Merges adjacent runs where a feature is non-zero, e.g. 'any_negative' - runs of frames with any negative emotion
+
+    @param sparse: Sparse
+    @param name: registered feature (see emotions.register_feature), zero for frames without emotions
+    @return: a dataframe of runs ('subject', 'first', 'frames', 'start_ms', 'end_ms')
+    """
+
+    runs = sparse.runs[FEATURES[name][sparse.runs['code'].to_numpy()] != 0]
+    row, first, frames = runs['subject'].to_numpy(), runs['first'].to_numpy(), runs['frames'].to_numpy()
+
+    new = np.ones(len(runs), dtype=bool)
+    new[1:] = (row[1:] != row[:-1]) | (first[:-1] + frames[:-1] != first[1:])
+    starts = np.flatnonzero(new)
+    stops = np.append(starts, len(runs))[1:]
+
+    return pd.DataFrame({'subject': row[starts], 'first': first[starts],
+                         'frames': np.add.reduceat(frames, starts) if len(starts) else frames[:0],
+                         'start_ms': runs['start_ms'].to_numpy()[starts],
+                         'end_ms': runs['end_ms'].to_numpy()[stops - 1]})
+
+
+def time_to_first(sparse, name='any_positive'):
+
+    """
+    @param sparse: Sparse
+    @param name: registered feature, zero for frames without emotions
+    @return: a series indexed by ('video_id', 'subject_id'): ms from the start of the video to the first frame where
+             the feature is non-zero; nan if there is no such frame
+    """
+
+    runs = sparse.runs[FEATURES[name][sparse.runs['code'].to_numpy()] != 0]
+    ms = np.full(len(sparse.subjects), np.nan)
+    # runs are ordered within a subject => the first run of each subject comes first
+    row, k = np.unique(runs['subject'].to_numpy(), return_index=True)
+    ms[row] = runs['start_ms'].to_numpy()[k]
+
+    return pd.Series(ms, index=_index(sparse), name='time_to_first_' + name)
+
+
+def longest_run(sparse, name='any_negative'):
+
+    """
+    @param sparse: Sparse
+    @param name: registered feature, zero for frames without emotions
+    @return: a dataframe indexed by ('video_id', 'subject_id') with duration ('ms') and number of frames ('frames') of
+             the longest run where the feature is non-zero; 0 if there is no such run
+    """
+
+    runs = feature_runs(sparse, name)
+    row = runs['subject'].to_numpy()
+    duration = (runs['end_ms'] - runs['start_ms']).to_numpy()
+
+    # longest run of each subject: sort by duration, keep the last run of each subject
+    order = np.lexsort((duration, row))
+    last = order[np.append(row[order][1:] != row[order][:-1], True)] if len(order) else order
+    df = pd.DataFrame({'ms': 0, 'frames': 0}, index=_index(sparse))
+    df.iloc[row[last], 0] = duration[last]
+    df.iloc[row[last], 1] = runs['frames'].to_numpy()[last]
+
+    return df
@@ -0,0 +1,121 @@
+"""
+Out-of-core mode: video files are read in chunks cut on subject boundaries, each chunk is cleaned on its own and only
+per-subject / per-time-bin aggregates are kept. Peak memory is bounded by the chunk size plus the largest subject.
+"""
+
+
+import numpy as np
+import pandas as pd
+
+from _code.functions import ID_COLUMNS, data_files, read_video, fill_id_gaps, no_value_emotion_proportion, \
+    StreamingDeduplicator
+from _code.aggregates import AggregateStore
+from _code.pipeline import SORT_COLUMNS
+from _code.profiling import profiler
+
+
+def subject_chunks(file, chunksize=10 ** 6, packed=False):
+
+    """
+    Reads a video file in chunks which contain whole subjects. A chunk is cut between two frames of different subjects
+    with known ids, so that missing ids can be replaced within a chunk.
+
+    @param file: path to a video file
+    @param chunksize: number of rows parsed at once
+    @param packed: see read_video
+    @return: generator of typed dataframes (see read_video)
+    """
+
+    carry = None
+    for chunk in read_video(file, chunksize, packed=packed):
+        df = chunk if carry is None else pd.concat([carry, chunk], ignore_index=True)
+
+        subject = df['subject_id'].to_numpy()
+        known = df['no_value_id'].to_numpy() == 0
+        cuts = np.flatnonzero((subject[1:] != subject[:-1]) & known[1:] & known[:-1]) + 1
+
+        if len(cuts):
+            yield df.iloc[:cuts[-1]].reset_index(drop=True)
+            carry = df.iloc[cuts[-1]:].reset_index(drop=True)
+        else:
+            carry = df
+
+    if carry is not None and len(carry):
+        yield carry
+
+
+@profiler.profile
+def clean_chunk(df, threshold=30):
+
+    """
+    Cleans a chunk with whole subjects: replaces missing ids, drops subjects with proportion of missing emotion data
+    greater than a threshold, drops frames with missing values and sorts the frames
+
+    @param df: a chunk from subject_chunks
+    @param threshold: see remove_subjects_no_value_emotion
+    @return: a cleaned dataframe + a dataframe of subjects ('video_id', 'subject_id', 'removed') + number of frames
+             dropped because their ids could not be replaced
+    """
+
+    ids, missing = fill_id_gaps([df[c].to_numpy() for c in ID_COLUMNS], df['frame_no'].to_numpy(),
+                                df['no_value_id'].to_numpy(dtype=bool))
+    df = df.copy(deep=False)
+    for c, x in zip(ID_COLUMNS, ids):
+        df[c] = x
+    df = df[~missing]
+
+    removed = no_value_emotion_proportion(df) > threshold
+    subjects = pd.DataFrame({'video_id': df['video_id'].to_numpy(), 'subject_id': df['subject_id'].to_numpy(),
+                             'removed': removed}).drop_duplicates(['video_id', 'subject_id'])
+
+    df = df[~removed & (df['no_value_emotion'].to_numpy() == 0)]
+    df = df.sort_values(SORT_COLUMNS, ignore_index=True)
+
+    return df, subjects, int(missing.sum())
+
+
+@profiler.profile
+def stream(path, threshold=30, chunksize=10 ** 6, store=None, consumers=(), packed=False):
+
+    """
+    Cleans all video files chunk by chunk and merges the cleaned chunks into an aggregate store
+
+    @param path: data_path or data_path_jup
+    @param threshold: see remove_subjects_no_value_emotion
+    @param chunksize: number of rows parsed at once
+    @param store: AggregateStore to update; None - a new store with default parameters
+    @param consumers: additional functions called with each cleaned chunk
+    @param packed: True - chunks carry one packed emotion column (see functions.pack_frame), which the store and the
+                   consumers of packed emotions (pyramid.TimePyramid, sparse.encode) read without packing
+    @return: the aggregate store
+    """
+
+    if store is None:
+        store = AggregateStore()
+
+    subjects, unresolved = [], 0
+    for file in data_files(path).values():
+        deduplicator = StreamingDeduplicator(bounded=True)
+        for chunk in subject_chunks(file, chunksize, packed):
+            df, s, n = clean_chunk(chunk, threshold)
+            subjects.append(s)
+            unresolved += n
+            df = deduplicator.process(df)
+            store.update(df)
+            for consumer in consumers:
+                consumer(df)
+        deduplicator.report()
+
+    if unresolved:
+        profiler.message('{} frames with missing ids which could not be replaced were dropped'.format(unresolved))
+
+    # header-only files give no chunks
+    if subjects:
+        subjects = pd.concat(subjects)
+        x = subjects.groupby('video_id')['removed'].mean()
+        total = subjects['removed'].mean()
+        profiler.message('Video ID \t Proportion of removed subjects per each video, in %')
+        profiler.message((x * 100).round(1))
+        profiler.message('In total it was removed {}% of subjects \n'.format(round(total * 100, 1)))
+
+    return store
@@ -0,0 +1,166 @@
+"""
+Subject index over frames sorted by ['video_id', 'subject_id', ...]: each subject is a contiguous segment of rows, so
+the index is an offsets array (CSR-style) built once. Per-subject and per-video reductions run as segment operations
+(np.add.reduceat etc.) on the offsets instead of hashing ids in every groupby.
+
+    index = SubjectIndex(df)
+    df['no_of_frames'] = index.repeat(index.sizes)
+    df['time_diff'] = index.diff(df['millisecond_from_start'])
+    df.iloc[index.rows(subject_id)]
+"""
+
+
+import numpy as np
+import pandas as pd
+
+
+class SubjectIndex:
+
+    """
+    Segments of subjects and videos in a sorted dataframe.
+    offsets[k]:offsets[k + 1] are the rows of subject k (subject_ids[k] of video video_ids[k]);
+    video_offsets[j]:video_offsets[j + 1] are the subjects of video videos[j].
+    """
+
+    def __init__(self, df):
+        video = df['video_id'].to_numpy()
+        subject = df['subject_id'].to_numpy()
+
+        new = np.ones(len(df), dtype=bool)
+        new[1:] = (subject[1:] != subject[:-1]) | (video[1:] != video[:-1])
+        starts = np.flatnonzero(new)
+        self.offsets = np.append(starts, len(df))
+        self.subject_ids = subject[starts]
+        self.video_ids = video[starts]
+
+        new_video = np.ones(len(starts), dtype=bool)
+        new_video[1:] = self.video_ids[1:] != self.video_ids[:-1]
+        self.video_offsets = np.append(np.flatnonzero(new_video), len(starts))
+        self.videos = self.video_ids[self.video_offsets[:-1]]
+        if len(np.unique(self.videos)) != len(self.videos):
+            raise ValueError('frames are not sorted by video_id, subject_id')
+
+        self._lookup = None
+
+    def __len__(self):
+        return len(self.subject_ids)
+
+    @property
+    def sizes(self):
+        # number of frames of each subject
+        return np.diff(self.offsets)
+
+    @property
+    def starts(self):
+        return self.offsets[:-1]
+
+    @property
+    def stops(self):
+        return self.offsets[1:]
+
+    def position(self, subject_id):
+
+        """
+        @param subject_id: subject id
+        @return: number of the subject in the index
+        """
+
+        if self._lookup is None:
+            self._lookup = dict(zip(self.subject_ids.tolist(), range(len(self))))
+
+        return self._lookup[subject_id]
+
+    def rows(self, subject_id):
+
+        """
+        @param subject_id: subject id
+        @return: slice of the subject's rows
+        """
+
+        k = self.position(subject_id)
+
+        return slice(self.offsets[k], self.offsets[k + 1])
+
+    def video_rows(self, video_id):
+
+        """
+        @param video_id: video id
+        @return: slice of the video's rows
+        """
+
+        j = np.flatnonzero(self.videos == video_id)[0]
+
+        return slice(self.offsets[self.video_offsets[j]], self.offsets[self.video_offsets[j + 1]])
+
+    def frame(self, **columns):
+
+        """
+        @param columns: per-subject arrays
+        @return: a dataframe indexed by ('video_id', 'subject_id') with the given columns
+        """
+
+        return pd.DataFrame(columns, index=pd.MultiIndex.from_arrays([self.video_ids, self.subject_ids],
+                                                                     names=['video_id', 'subject_id']))
+
+    # per-subject reductions; values are per-frame arrays or series aligned with the sorted dataframe
+
+    def _reduce(self, ufunc, values, dtype=None):
+        x = np.asarray(values, dtype=dtype)
+        return ufunc.reduceat(x, self.starts) if len(x) else x[:0]
+
+    def sum(self, values):
+        return self._reduce(np.add, values)
+
+    def mean(self, values):
+        return self._reduce(np.add, values, np.float64) / self.sizes
+
+    def min(self, values):
+        return self._reduce(np.minimum, values)
+
+    def max(self, values):
+        return self._reduce(np.maximum, values)
+
+    def any(self, values):
+        return self._reduce(np.logical_or, values, bool)
+
+    def all(self, values):
+        return self._reduce(np.logical_and, values, bool)
+
+    def first(self, values):
+        return np.asarray(values)[self.starts]
+
+    def last(self, values):
+        return np.asarray(values)[self.stops - 1]
+
+    def repeat(self, values):
+        # per-subject values broadcast to the frames of each subject (as groupby().transform)
+        return np.repeat(np.asarray(values), self.sizes)
+
+    def diff(self, values):
+        # difference with the previous frame of the subject, nan for the first frame (as groupby().diff)
+        x = np.asarray(values, dtype=np.float64)
+        d = np.empty_like(x)
+        d[1:] = np.diff(x)
+        d[self.starts] = np.nan
+        return d
+
+    # per-video reductions of per-subject values
+
+    def video_subjects(self):
+        # number of subjects of each video
+        return pd.Series(np.diff(self.video_offsets), index=pd.Index(self.videos, name='video_id'))
+
+    def video_reduce(self, ufunc, values):
+
+        """
+        Reduces per-subject values over the subjects of each video
+
+        @param ufunc: e.g. np.add, np.minimum, np.maximum
+        @param values: per-subject array
+        @return: a series indexed by video_id
+        """
+
+        x = np.asarray(values)
+        x = ufunc.reduceat(x, self.video_offsets[:-1]) if len(x) else x[:0]
+
+        return pd.Series(x, index=pd.Index(self.videos, name='video_id'))
@@ -0,0 +1,111 @@
+"""
+Synthetic data generator: writes files shaped like dsc_homework_video_X.csv, with variable framerates, 'No value'
+entries, runs of missing ids and duplicated frames.
+"""
+
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from _code.functions import COLUMNS, EMOTIONS, NO_VALUE
+
+
+def generate_subjects(video_id, subject_ids, rng, frames=300, interval_ms=(30, 120), jitter_ms=5, emotion_rate=0.05,
+                      no_value_rate=0.05, id_gap_rate=0.002, id_gap_length=3, duplicate_rate=0.01, boundary_gaps=True):
+
+    """
+    Generates frames of several subjects of one video
+
+    @param video_id: video id
+    @param subject_ids: ids of subjects
+    @param rng: numpy random generator
+    @param frames: average number of frames per subject
+    @param interval_ms: range of average time between frames of a subject (framerate varies between subjects)
+    @param jitter_ms: standard deviation of time between frames of a subject
+    @param emotion_rate: probability of each emotion in a frame
+    @param no_value_rate: average proportion of frames with missing emotions (varies between subjects)
+    @param id_gap_rate: probability that a run of missing ids starts at a frame
+    @param id_gap_length: average length of runs of missing ids
+    @param duplicate_rate: proportion of duplicated frames
+    @param boundary_gaps: False - the first and last frames of a subject keep their ids, so runs of missing ids never
+                          cross a subject boundary; such runs cannot be attributed to a subject by the cleaning chains
+                          (replace_no_value_id, fill_id_gaps)
+    @return: a dataframe with 'No value' entries (object columns)
+    """
+
+    n_subjects = len(subject_ids)
+    sizes = np.maximum(rng.poisson(frames, n_subjects), 1)
+    first = np.cumsum(sizes) - sizes
+    n = sizes.sum()
+
+    # time between frames: the first step is an offset from the video start
+    step = np.maximum(rng.normal(np.repeat(rng.uniform(*interval_ms, n_subjects), sizes), jitter_ms), 1)
+    step[first] = rng.uniform(0, interval_ms[1], n_subjects)
+    ms = np.cumsum(step)
+    ms = np.round(ms - np.repeat(ms[first] - step[first], sizes)).astype(np.int64)
+
+    df = pd.DataFrame({'video_id': video_id, 'subject_id': np.repeat(np.asarray(subject_ids), sizes),
+                       'frame_no': np.arange(n) - np.repeat(first, sizes) + 1, 'millisecond_from_start': ms})
+    for c in EMOTIONS:
+        df[c] = (rng.random(n) < emotion_rate).astype(np.int64)
+
+    # proportion of missing emotions varies between subjects
+    no_value = rng.random(n) < np.repeat(rng.exponential(no_value_rate, n_subjects), sizes)
+
+    # duplicated frames follow the original ones
+    rows = np.repeat(np.arange(n), 1 + (rng.random(n) < duplicate_rate))
+    df = df.iloc[rows].reset_index(drop=True).astype(object)
+    n = len(df)
+
+    df.loc[no_value[rows], EMOTIONS] = NO_VALUE
+
+    # runs of missing ids, never at the very beginning or end
+    gap = np.zeros(n + 1, dtype=np.int64)
+    starts = np.flatnonzero(rng.random(n) < id_gap_rate)
+    np.add.at(gap, starts, 1)
+    np.add.at(gap, np.minimum(starts + rng.geometric(1 / id_gap_length, len(starts)), n), -1)
+    missing = np.cumsum(gap[:-1]) > 0
+    missing[[0, -1]] = False
+    if not boundary_gaps:
+        subject = df['subject_id'].to_numpy()
+        boundary = np.zeros(n, dtype=bool)
+        boundary[1:] = subject[1:] != subject[:-1]
+        boundary[:-1] |= boundary[1:]
+        missing &= ~boundary
+    df.loc[missing, ['video_id', 'subject_id']] = NO_VALUE
+
+    return df[COLUMNS]
+
+
+def write_videos(directory, rows=10 ** 5, videos=3, frames=300, seed=0, subjects_per_chunk=1000, **kwargs):
+
+    """
+    Writes synthetic dsc_homework_video_X.csv files
+
+    @param directory: target directory
+    @param rows: approximate total number of rows
+    @param videos: number of video files
+    @param frames: average number of frames per subject
+    @param seed: random seed
+    @param subjects_per_chunk: number of subjects generated and written at once
+    @param kwargs: see generate_subjects
+    @return: a function returning the path to video i (as data_path)
+    """
+
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    def path(i):
+        return os.path.join(directory, 'dsc_homework_video_{}.csv'.format(i))
+
+    n_subjects = max(rows // (frames * videos), 1)
+    for v in range(1, videos + 1):
+        with open(path(v), 'w') as f:
+            f.write(','.join(COLUMNS) + '\n')
+            for s in range(0, n_subjects, subjects_per_chunk):
+                ids = v * 10 ** 7 + np.arange(s, min(s + subjects_per_chunk, n_subjects))
+                generate_subjects(v, ids, rng, frames=frames, **kwargs).to_csv(f, header=False, index=False)
+
+    return path
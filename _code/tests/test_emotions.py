@@ -0,0 +1,34 @@
+import io
+import contextlib
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from _code.functions import EMOTIONS, EMOTION_CODE, load_videos, pack_frame, unpack_frame, remove_duplicates
+from _code.emotions import aggregate
+from _code.synthetic import write_videos
+
+
+@pytest.fixture(scope='module')
+def frames(tmp_path_factory):
+    # the same videos loaded with emotion columns and with packed emotions
+    with contextlib.redirect_stdout(io.StringIO()):
+        path = write_videos(str(tmp_path_factory.mktemp('videos')), rows=5000, seed=0, duplicate_rate=0.05)
+        return load_videos(path)[0], load_videos(path, packed=True)[0]
+
+
+def test_load_packed(frames):
+    df, packed = frames
+
+    assert EMOTION_CODE in packed.columns and not set(EMOTIONS) & set(packed.columns)
+    assert packed[EMOTION_CODE].dtype == np.uint8
+    pd.testing.assert_frame_equal(unpack_frame(packed), df)
+    pd.testing.assert_frame_equal(pack_frame(df), packed)
+
+
+def test_packed_consumers(frames):
+    df, packed = frames
+
+    pd.testing.assert_frame_equal(aggregate(packed, ['video_id']), aggregate(df, ['video_id']))
+    assert remove_duplicates(packed).index.equals(remove_duplicates(df).index)
@@ -0,0 +1,54 @@
+"""
+Equivalence of the vectorized id gap filling (replace_no_value_id_typed) with replace_no_value_id on random frames
+with frame_no jumps and runs of missing ids.
+"""
+
+
+import io
+import contextlib
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from _code.functions import COLUMNS, ID_COLUMNS, NO_VALUE, NO_VALUE_INT, read_video, replace_no_value_id, \
+    replace_no_value_id_typed
+
+
+def random_video(rng):
+    # a csv with several subjects; frame_no steps of 0, 1 or 2 and missing ids at random frames
+    rows = []
+    for s in range(rng.integers(2, 8)):
+        n = rng.integers(3, 15)
+        frame_no = np.cumsum(rng.choice([1, 1, 1, 2, 0], n))
+        rows += [[7, 100 + s, frame_no[k], k * 40, 0, 1, 0, 0, 0] for k in range(n)]
+    df = pd.DataFrame(rows, columns=COLUMNS).astype(object)
+
+    missing = rng.random(len(df)) < 0.3
+    missing[[0, -1]] = False
+    df.loc[missing, ID_COLUMNS] = NO_VALUE
+
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize('seed', range(300))
+def test_replace_no_value_id_typed_matches_legacy(seed):
+    text = random_video(np.random.default_rng(seed))
+
+    legacy = pd.read_csv(io.StringIO(text))
+    legacy['no_value_id'] = legacy['subject_id'].apply(lambda x: 1 if str(x) == NO_VALUE else 0)
+    legacy['no_value_emotion'] = 0
+    typed = next(read_video(io.StringIO(text)))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        if legacy['no_value_id'].any():
+            legacy.update(replace_no_value_id(legacy))
+        typed = replace_no_value_id_typed(typed)
+
+    for c in ID_COLUMNS:
+        expected = legacy[c].astype(str).replace(NO_VALUE, str(NO_VALUE_INT)).astype(float).astype(int).to_numpy()
+        np.testing.assert_array_equal(typed[c].to_numpy(), expected)
+    np.testing.assert_array_equal(typed['no_value_id'].to_numpy(),
+                                  (legacy['subject_id'].astype(str) == NO_VALUE).to_numpy().astype('uint8'))
@@ -0,0 +1,30 @@
+import numpy as np
+import pandas as pd
+
+from _code.inference import permutation_test
+
+
+def subjects(n=500, seed=0):
+    # per-subject sums of three videos; video 3 is shifted
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({'video_id': np.repeat([1, 2, 3], n), 'frames': rng.integers(1, 50, 3 * n)})
+    df['metric_1'] = df['frames'] * (rng.normal(0, 1, 3 * n) + np.repeat([0, 0, 1], n))
+    return df
+
+
+def test_permutation_test_intervals():
+    result = permutation_test(subjects(), 'metric_1', n_resamples=2000, batch_size=300)
+
+    assert list(result.columns) == ['video_a', 'video_b', 'difference', 'ci_low', 'ci_high', 'p_value']
+    assert ((result['ci_low'] <= result['difference']) & (result['difference'] <= result['ci_high'])).all()
+    # the interval excludes 0 for pairs with video 3 only
+    shifted = (result['video_b'] == 3).to_numpy()
+    assert ((result['ci_high'] < 0).to_numpy() == shifted).all()
+
+
+def test_permutation_test_workers():
+    df = subjects(n=100)
+    kwargs = dict(n_resamples=500, batch_size=200, seed=1)
+
+    pd.testing.assert_frame_equal(permutation_test(df, 'metric_1', max_workers=1, **kwargs),
+                                  permutation_test(df, 'metric_1', max_workers=2, **kwargs))
@@ -0,0 +1,120 @@
+"""
+Memory regression tests. The tracemalloc peak of a transformer is bounded by the bytes of the columns it produces
+plus a few bytes per row for boolean masks and run boundaries, so a copy of the input shows up as a failure.
+Plots and no_value produce no columns: the growth of their peak from a small to a large dataframe is bounded by the
+masks alone, the rest is the fixed cost of drawing.
+"""
+
+
+import io
+import os
+import contextlib
+import tracemalloc
+
+import pandas as pd
+import pytest
+
+from _code.functions import ID_COLUMNS, load_videos, no_value, replace_no_value_id, replace_no_value_id_sub, \
+    replace_no_value_id_typed, remove_subjects_no_value_emotion, remove_duplicates, plot_no_value_emotion, \
+    plot_num_of_frames, plot_time, plot_emotion_evolution
+from _code.emotions import aggregate, README_METRICS
+from _code.subjects import SubjectIndex
+from _code.synthetic import write_videos
+
+
+SMALL, LARGE = 20000, 200000
+# bytes per row of boolean masks and run boundaries
+MASKS = 4
+# peak / bytes of the produced columns
+GROWTH = 1.5
+# allocator noise of drawing, bytes
+SLACK = 2 ** 16
+
+
+def peak(f, *args, **kwargs):
+    # tracemalloc peak of a call; a first call loads modules and caches
+    with contextlib.redirect_stdout(io.StringIO()):
+        f(*args, **kwargs)
+        tracemalloc.start()
+        try:
+            result = f(*args, **kwargs)
+            return result, tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+
+def nbytes(df):
+    return df.memory_usage(index=True, deep=True).sum()
+
+
+@pytest.fixture(scope='module')
+def frames(tmp_path_factory):
+    # typed, cleaned and legacy (object) frames of a small and a large synthetic dataset
+    frames = {}
+    for rows in (SMALL, LARGE):
+        directory = tmp_path_factory.mktemp('videos')
+        with contextlib.redirect_stdout(io.StringIO()):
+            path = write_videos(str(directory), rows=rows, seed=0)
+            typed, _ = load_videos(path)
+            replaced = replace_no_value_id_typed(typed)
+
+        df = replaced[replaced['no_value_id'] == 0].sort_values(
+            ['video_id', 'subject_id', 'frame_no', 'millisecond_from_start'], ignore_index=True)
+        subjects = SubjectIndex(df)
+        df['no_of_frames'] = subjects.repeat(subjects.sizes)
+        df['time_bin'] = df['millisecond_from_start'] // 100 + 1
+
+        legacy = pd.read_csv(path(1))
+        legacy['no_value_id'] = (legacy['subject_id'] == 'No value').astype('int')
+
+        frames[rows] = {'typed': typed, 'replaced': replaced, 'clean': df, 'legacy': legacy, 'directory': directory,
+                        'emotion': aggregate(df, ['video_id', 'time_bin']).reset_index()}
+
+    return frames
+
+
+def test_replace_no_value_id_typed(frames):
+    df = frames[LARGE]['typed']
+    result, p = peak(replace_no_value_id_typed, df)
+
+    assert p <= GROWTH * result[ID_COLUMNS + ['no_value_id']].memory_usage(index=False).sum() + MASKS * len(df)
+
+
+def test_replace_no_value_id(frames):
+    df = frames[LARGE]['legacy']
+    result, p = peak(replace_no_value_id, df)
+
+    assert p <= GROWTH * nbytes(result) + MASKS * len(df)
+
+
+def test_replace_no_value_id_sub(frames):
+    df = frames[LARGE]['legacy']
+    result, p = peak(replace_no_value_id_sub, df, 'preceding')
+
+    assert p <= GROWTH * nbytes(result[ID_COLUMNS]) + MASKS * len(df)
+
+
+@pytest.mark.parametrize('transformer', [remove_subjects_no_value_emotion, remove_duplicates])
+def test_filter(frames, transformer):
+    df = frames[LARGE]['clean']
+    result, p = peak(transformer, df)
+
+    assert p <= GROWTH * nbytes(result) + MASKS * len(df)
+
+
+@pytest.mark.parametrize('name, plot, frame, kwargs', [
+    ('no_value_emotion', plot_no_value_emotion, 'replaced', {}),
+    ('num_of_frames', plot_num_of_frames, 'clean', {}),
+    ('time', plot_time, 'clean', {}),
+    ('emotion_evolution', plot_emotion_evolution, 'emotion', {'metrics': [m + '_avg' for m in README_METRICS]}),
+    ('no_value', lambda df, output: no_value(df), 'clean', {})])
+def test_growth(frames, name, plot, frame, kwargs):
+    pytest.importorskip('matplotlib')
+
+    peaks = []
+    for rows in (SMALL, LARGE):
+        output = os.path.join(str(frames[rows]['directory']), name + '.png')
+        peaks.append(peak(plot, frames[rows][frame], output=output, **kwargs)[1])
+
+    rows = len(frames[LARGE][frame]) - len(frames[SMALL][frame])
+    assert peaks[1] - peaks[0] <= MASKS * max(rows, 0) + SLACK
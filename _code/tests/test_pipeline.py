@@ -0,0 +1,43 @@
+"""
+The legacy cleaning chain of a video file drops frames whose ids could not be replaced, as the typed chain does, and
+returns an empty typed frame when no frames are left.
+"""
+
+
+import io
+import contextlib
+
+import pandas as pd
+import pytest
+
+from _code.functions import COLUMNS, read_video, replace_no_value_id_typed
+from _code.pipeline import clean_video
+from _code.synthetic import write_videos
+
+
+def test_clean_video_drops_unresolved_ids(tmp_path):
+    with contextlib.redirect_stdout(io.StringIO()):
+        path = write_videos(str(tmp_path), rows=20000, videos=1, seed=0, id_gap_rate=0.02, duplicate_rate=0.05)
+        typed = replace_no_value_id_typed(next(read_video(path(1), chunksize=10 ** 6)))
+        df, records = clean_video(path(1))
+
+    records = pd.DataFrame(records).set_index('stage')
+    unresolved = int(typed['no_value_id'].sum())
+    assert unresolved > 0
+    assert records.loc['drop_unresolved_id', 'rows_in'] - records.loc['drop_unresolved_id', 'rows_out'] == unresolved
+    assert (df.dtypes == 'int32').all()
+
+
+@pytest.mark.parametrize('header_only', [False, True])
+def test_clean_video_empty(tmp_path, header_only):
+    with contextlib.redirect_stdout(io.StringIO()):
+        path = write_videos(str(tmp_path), rows=5000, videos=1, seed=0, no_value_rate=1)
+        if header_only:
+            with open(path(1), 'w') as f:
+                f.write(','.join(COLUMNS) + '\n')
+        # every subject has missing emotions => all of them are removed with threshold 0
+        df, records = clean_video(path(1), threshold=0)
+
+    assert len(df) == 0
+    assert list(df.columns) == COLUMNS
+    assert records[-1]['stage'] == 'remove_duplicates'
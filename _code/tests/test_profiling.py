@@ -0,0 +1,30 @@
+"""
+The pipeline functions are wrapped with the default profiler: when it is enabled with a sink they record stages and
+their progress messages go to the sink instead of stdout.
+"""
+
+
+import io
+import contextlib
+
+import pandas as pd
+
+from _code.functions import EMOTIONS, remove_duplicates
+from _code.profiling import profiler
+
+
+def test_pipeline_functions_are_profiled():
+    df = pd.DataFrame({c: [1, 1, 2] for c in ['video_id', 'subject_id', 'millisecond_from_start'] + EMOTIONS})
+    records, stdout = [], io.StringIO()
+
+    profiler.enabled, profiler.sinks, profiler.records = True, [records.append], []
+    try:
+        with contextlib.redirect_stdout(stdout):
+            remove_duplicates(df)
+    finally:
+        profiler.enabled, profiler.sinks, profiler.records = False, [], []
+
+    assert stdout.getvalue() == ''
+    assert records[0] == {'stage': 'remove_duplicates', 'message': '1 (33.3%) duplicates dropped'}
+    assert records[1]['stage'] == 'remove_duplicates'
+    assert (records[1]['rows_in'], records[1]['rows_out']) == (3, 2)
@@ -0,0 +1,42 @@
+"""
+Sparse per-subject means agree with the dense time-weighted metrics, with and without capped gaps, and an empty
+frame encodes to empty tables.
+"""
+
+
+import io
+import contextlib
+
+import numpy as np
+import pytest
+
+from _code.functions import load_videos
+from _code.features import frame_duration, weighted_metrics
+from _code.sparse import encode, subject_means, bin_means, longest_run
+from _code.streaming import clean_chunk
+from _code.synthetic import write_videos
+
+
+@pytest.fixture(scope='module')
+def frames(tmp_path_factory):
+    with contextlib.redirect_stdout(io.StringIO()):
+        path = write_videos(str(tmp_path_factory.mktemp('videos')), rows=30000, seed=3)
+        df, _ = load_videos(path)
+        df, _, _ = clean_chunk(df)
+    return df
+
+
+@pytest.mark.parametrize('max_gap_ms', [None, 60])
+def test_subject_means_match_weighted_metrics(frames, max_gap_ms):
+    sparse = subject_means(encode(frames, max_gap_ms), weight='duration')
+    dense = weighted_metrics(frames, max_gap_ms=max_gap_ms)
+
+    assert np.allclose(sparse.to_numpy(), dense[sparse.columns].to_numpy())
+
+
+def test_encode_empty(frames):
+    sparse = encode(frames.iloc[:0])
+
+    assert len(sparse.subjects) == len(sparse.runs) == 0
+    assert len(subject_means(sparse)) == len(bin_means(sparse)) == len(longest_run(sparse)) == 0
+    assert len(frame_duration(frames.iloc[:0])) == len(weighted_metrics(frames.iloc[:0])) == 0
@@ -0,0 +1,46 @@
+"""
+Streaming cleaning: files without frames left after cleaning and header-only files give empty aggregates; the
+deduplicator of unsorted chunks drops the same frames as remove_duplicates on the whole frame.
+"""
+
+
+import io
+import contextlib
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from _code.functions import COLUMNS, DUPLICATE_COLUMNS, load_videos, remove_duplicates, StreamingDeduplicator
+from _code.streaming import stream
+from _code.synthetic import write_videos
+
+
+@pytest.mark.parametrize('header_only', [False, True])
+def test_stream_empty(tmp_path, header_only):
+    with contextlib.redirect_stdout(io.StringIO()):
+        path = write_videos(str(tmp_path), rows=5000, videos=1, seed=0, no_value_rate=1)
+        if header_only:
+            with open(path(1), 'w') as f:
+                f.write(','.join(COLUMNS) + '\n')
+        # every subject has missing emotions => all of them are removed with threshold 0
+        store = stream(path, threshold=0, chunksize=1000)
+
+    assert len(store.video_means()) == 0
+
+
+def test_unbounded_deduplicator(tmp_path):
+    with contextlib.redirect_stdout(io.StringIO()):
+        path = write_videos(str(tmp_path), rows=20000, videos=2, seed=1, duplicate_rate=0.05)
+        df, _ = load_videos(path)
+        df = df[df['no_value_id'] == 0].reset_index(drop=True)
+        expected = len(remove_duplicates(df))
+
+    # subjects are spread over all chunks
+    df = df.iloc[np.random.default_rng(0).permutation(len(df))]
+    deduplicator = StreamingDeduplicator(bounded=False)
+    kept = pd.concat([deduplicator.process(df.iloc[k:k + 3000]) for k in range(0, len(df), 3000)])
+
+    # the first of the duplicated frames in the order of the chunks is kept
+    assert len(kept) == expected
+    assert not kept.duplicated(DUPLICATE_COLUMNS).any()